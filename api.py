@@ -0,0 +1,145 @@
+# HTTP service exposing ingestion, search and streaming chat.
+#
+#   uvicorn api:app --workers 4 --port 8000
+#
+# Every worker loads the models once at startup (lifespan) and shares them
+# between requests. Jobs live in the shared SQLite job table, so any worker
+# can report on a job submitted to another one.
+
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+
+from src.retrieval.chunk_embed import EmbedData
+from src.retrieval.index import QdrantVDB, DEFAULT_COLLECTION
+from src.retrieval.jobs import JobQueue, document_names
+from src.retrieval.retriever import Retriever
+from src.retrieval.reranker import Reranker
+from src.retrieval.rag_engine import RAG, create_llm_client
+
+
+class SearchRequest(BaseModel):
+    query: str
+    collection: str = DEFAULT_COLLECTION
+    doc_ids: list[str] | None = None
+    # metadata filters, e.g. {"course": "dolci", "ingredients": ["mele"], "page": [10, 20]}
+    filters: dict | None = None
+    top_k: int = 7
+
+
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    query: str
+    collection: str = DEFAULT_COLLECTION
+    doc_ids: list[str] | None = None
+    filters: dict | None = None
+    difficulty: str = "medium"
+    history: list[Message] = []
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # loading the weights takes seconds: keep it off the event loop
+    app.state.embed_model = await asyncio.to_thread(lambda: EmbedData().embed_model)
+    app.state.reranker = (await asyncio.to_thread(Reranker)
+                          if os.getenv("RERANKER_ENABLED", "false").lower() == "true" else None)
+    app.state.llm_client = create_llm_client()
+    # unfinished jobs are resumed by the Streamlit app, not by each API worker
+    app.state.jobs = JobQueue(max_workers=int(os.getenv("INGEST_WORKERS", 1)), resume=False,
+                              prewarm=os.getenv("INGEST_PREWARM", "false").lower() == "true")
+    app.state.retrievers = {}
+    yield
+
+    app.state.jobs.pool.shutdown(wait=False, cancel_futures=True)
+    for retriever in app.state.retrievers.values():
+        if retriever.vector_db._async_client is not None:
+            await retriever.vector_db.async_client.close()
+    await app.state.llm_client.async_client.close()
+
+
+app = FastAPI(title="Exam Trainer Agent API", lifespan=lifespan)
+
+
+def get_retriever(collection_name):
+    retrievers = app.state.retrievers
+    if collection_name not in retrievers:
+        embeddata = EmbedData(embed_model=app.state.embed_model)
+        vector_db = QdrantVDB(collection_name=collection_name)
+        retrievers[collection_name] = Retriever(vector_db, embeddata=embeddata, reranker=app.state.reranker)
+    return retrievers[collection_name]
+
+
+@app.post("/documents", status_code=202)
+async def ingest_document(request: Request, filename: str = Query(..., description="name of the uploaded PDF")):
+    """Queues the ingestion of a PDF sent as the raw request body (Content-Type: application/pdf)."""
+    data = await request.body()
+    if not data.startswith(b"%PDF"):
+        raise HTTPException(status_code=415, detail="the request body is not a PDF")
+
+    job_id = await asyncio.to_thread(app.state.jobs.submit, data, filename)
+    return {"job_id": job_id}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(app.state.jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/file")
+async def get_job_file(job_id: str):
+    """The uploaded PDF, for previews. Range requests are supported, so viewers fetch only the pages they show."""
+    job = await asyncio.to_thread(app.state.jobs.get, job_id)
+    if job is None or not os.path.isfile(job["pdf_path"]):
+        raise HTTPException(status_code=404, detail="file not found")
+    return FileResponse(job["pdf_path"], media_type="application/pdf",
+                        headers={"Cache-Control": "private, max-age=86400, immutable"})
+
+
+@app.get("/documents")
+async def list_documents(collection: str = DEFAULT_COLLECTION):
+    """doc_id (the content hash of the upload) and file name of every document in the collection."""
+    doc_ids = await asyncio.to_thread(get_retriever(collection).vector_db.list_documents)
+    names = await asyncio.to_thread(document_names)
+    return [{"doc_id": doc_id, "name": names.get(doc_id, doc_id)} for doc_id in doc_ids]
+
+
+@app.post("/search")
+async def search(body: SearchRequest):
+    try:
+        result = await get_retriever(body.collection).asearch(body.query, top_k=body.top_k, doc_ids=body.doc_ids,
+                                                              filters=body.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return [{"id": str(point.id), "score": point.score, "payload": point.payload} for point in result]
+
+
+@app.post("/chat")
+async def chat(body: ChatRequest):
+    """Streams the answer as server-sent events: one `data` event per delta, then `event: done`."""
+    # stateless: the client sends the conversation, the RAG only lives for this request
+    rag = RAG(get_retriever(body.collection), llm_client=app.state.llm_client, coalesce=False,
+              doc_ids=body.doc_ids, filters=body.filters)
+    for message in body.history:
+        rag.history.add(message.role, message.content)
+
+    stream = await rag.aquery(body.query, difficulty=body.difficulty)
+
+    async def events():
+        async for delta in stream:
+            yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+        yield f"event: done\ndata: {json.dumps({'stats': rag.last_stream_stats})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -4,21 +4,22 @@
 
 import streamlit as st
 import os
-import base64
-import tempfile
 import uuid
-import time
 import gc
+import psutil
 import nest_asyncio 
 nest_asyncio.apply()
 
-from src.retrieval.utils import convert_pdf_to_markdown
-from src.retrieval.chunk_embed import chunk_markdown, EmbedData, save_embeddings, load_embeddings
+from src.retrieval.chunk_embed import EmbedData
+from src.retrieval.jobs import JobQueue, document_names
 from src.retrieval.index import QdrantVDB
 from src.retrieval.retriever import Retriever
-from src.retrieval.rag_engine import RAG
+from src.retrieval.reranker import Reranker
+from src.retrieval.rag_engine import RAG, create_llm_client
 from llama_index.core import Settings
 
+EMBED_MODEL_NAME = "nomic-ai/nomic-embed-text-v1.5"
+
 # Configurazioni della pagina
 st.set_page_config(
     page_title="Exam Trainer Agent",
@@ -28,10 +29,89 @@ st.set_page_config(
 if "id" not in st.session_state:
     st.session_state.id = uuid.uuid4()
     st.session_state.file_cache = {}
+    st.session_state.file_jobs = {}
 
 session_id = st.session_state.id
 
 
+# Process-wide resources, shared by every browser session
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_embed_model(model_name=EMBED_MODEL_NAME):
+    return EmbedData(embed_model_name=model_name).embed_model
+
+
+@st.cache_resource(show_spinner="Loading reranker...")
+def get_reranker():
+    return Reranker()
+
+
+@st.cache_resource
+def get_llm_client():
+    return create_llm_client()
+
+
+@st.cache_resource
+def get_vector_db(collection_name, vector_dim):
+    return QdrantVDB(collection_name=collection_name, vector_dim=vector_dim, batch_size=7)
+
+
+@st.cache_resource
+def get_retriever(collection_name, vector_dim, model_name=EMBED_MODEL_NAME):
+    # the retriever only needs the embedding model for queries, not the document embeddings
+    embeddata = EmbedData(embed_model_name=model_name, embed_model=get_embed_model(model_name))
+    reranker = get_reranker() if os.getenv("RERANKER_ENABLED", "false").lower() == "true" else None
+    return Retriever(get_vector_db(collection_name, vector_dim), embeddata=embeddata, reranker=reranker)
+
+
+@st.cache_resource
+def model_memory_mb(model_name=EMBED_MODEL_NAME):
+    model = get_embed_model(model_name)._model
+    return sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+
+
+def report_memory():
+    rss_mb = psutil.Process().memory_info().rss / 2**20
+    st.caption(f"Memory: {rss_mb:.0f} MB process RSS, "
+               f"{model_memory_mb():.0f} MB embedding model weights (shared by all sessions)")
+
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(max_workers=int(os.getenv("INGEST_WORKERS", 1)),
+                    prewarm=os.getenv("INGEST_PREWARM", "false").lower() == "true")
+
+
+STAGE_MESSAGES = {
+    "queued": "📥 File uploaded successfully, waiting for a worker...",
+    "converting": "Identifying document layout...",
+    "chunking": "Splitting the document...",
+    "embedding": "Generating embeddings...",
+    "indexing": "Indexing the document...",
+    "done": "Ready to Chat...",
+}
+
+
+# Polls the background job without blocking the rest of the page
+@st.fragment(run_every=2)
+def ingestion_status(job_id, file_key):
+    job = get_job_queue().get(job_id)
+
+    if job["status"] == "done":
+        # the RAG holds this session's history, everything below it is shared
+        retriever = get_retriever(job["collection_name"], job["vector_dim"])
+        # jobs finished before doc_ids were content hashes used the file name
+        doc_id = job["doc_id"] or job["name"]
+        st.session_state.rag = RAG(retriever, llm_client=get_llm_client(), doc_ids=[doc_id])
+        st.session_state.doc_ids = [doc_id]
+        st.session_state.file_cache[file_key] = True
+        st.rerun()
+    elif job["status"] == "failed":
+        st.error(f"Ingestion failed: {job['error']}")
+    else:
+        st.info(STAGE_MESSAGES.get(job["stage"], job["stage"]))
+        st.progress(job["progress"])
+
+
 def reset_chat():
     st.session_state.messages = []
     st.session_state.context = None
@@ -41,15 +121,18 @@ def reset_chat():
     rag = st.session_state.get("rag")
     if rag:
         rag.last_question = None
-        rag.conversation_history = []
+        rag.history.clear()
 
     st.success("Chat cleared. You can start a new question now.")
 
 # Function to display the uploaded PDF in the app
-def display_pdf(file):
+# The PDF is served by Streamlit's static file handler, which answers HTTP range
+# requests: the browser viewer fetches only the pages it shows, and reruns resend
+# this small tag instead of the whole document.
+def display_pdf(pdf_path):
     st.markdown("### 📄 PDF Preview")
-    base64_pdf = base64.b64encode(file.read()).decode("utf-8")
-    pdf_display = f"""<iframe src="data:application/pdf;base64,{base64_pdf}" width="500" height="100%" type="application/pdf"
+    pdf_url = "app/" + pdf_path.replace(os.sep, "/")
+    pdf_display = f"""<iframe src="{pdf_url}" width="500" height="100%" type="application/pdf"
                         style="height:100vh; width:100%"
                     >
                     </iframe>"""
@@ -80,80 +163,39 @@ with st.sidebar:
     if uploaded_file:
         file_key = f"{session_id}-{uploaded_file.name}"
         if file_key not in st.session_state.file_cache:
-            status_placeholder = st.empty()
-            status_placeholder.info("📥 File uploaded successfully")
-        
-            time.sleep(2.5)  # Delay before switching message
-            name = uploaded_file.name.rsplit('.', 1)[0]
-
-            with tempfile.TemporaryDirectory() as temp_dir:
-                file_path = os.path.join(temp_dir, uploaded_file.name)
-                print(f"Temporary file path: {file_path}")
-                # Save uploaded file to temp dir
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getvalue())
-
-                status_placeholder.info("Identifying document layout...")
-                progress_bar = st.progress(10)
-
-                found = any(
-                    os.path.isfile(f) and f.startswith(f"embeddings_{name}" + '.')
-                    for f in os.listdir('.')
-                )
-
-                if not found:
-                    # Convert to markdown
-                    markdown_text = convert_pdf_to_markdown(file_path)
-                    st.session_state.markdown_text = markdown_text
-
-                    status_placeholder.info("Generating embeddings...")
-                    progress_bar.progress(50)
-                    
-                    chunks = chunk_markdown(markdown_text)
-                    st.session_state.chunks = chunks
-
-                    embeddata = EmbedData(batch_size=8)
-                    embeddata.embed(chunks)
-                    save_embeddings(embeddata, f"embeddings_{name}.pkl")
-
-                    st.session_state.embeddata = embeddata
-
-                    status_placeholder.info("Indexing the document...")
-                    progress_bar.progress(80)
-                
-                else:
-                    # se avevo già calcolato l'embeddings lo ricarico invece di ricalcolarmelo
-                    embeddata = load_embeddings(f"embeddings_{name}.pkl")
-                
-                database = QdrantVDB(collection_name=f"collection_{name}", vector_dim=len(embeddata.embeddings[0]), batch_size=7)
-                if database.client.collection_exists(f"collection_{name}"):
-                    status_placeholder.info("Collection exists — loading existing index.")
-                else:   
-                    status_placeholder.info("Collection does NOT exist — creating new index.")
-                    database.create_collection()
-                    database.ingest_data(embeddata)
-
-
-                st.session_state.database= database
-
-                # After vector DB and embeddata have been defined...
-                retriever = Retriever(database, embeddata=embeddata)
-                rag = RAG(retriever)
-                st.session_state.rag = rag
-                status_placeholder = st.empty()
-                st.success("Ready to Chat...")
-                progress_bar.progress(100)
-                st.session_state.file_cache[file_key] = True
+            if file_key not in st.session_state.file_jobs:
+                # the same content maps to the same job, across reruns and sessions
+                st.session_state.file_jobs[file_key] = get_job_queue().submit(uploaded_file.getvalue(),
+                                                                              uploaded_file.name)
+            ingestion_status(st.session_state.file_jobs[file_key], file_key)
                 
         else:
             st.success("Ready to Chat...")  
+
+        display_pdf(get_job_queue().get(st.session_state.file_jobs[file_key])["pdf_path"])
             
 
+    # all documents share one collection: pick which ones this chat searches
+    rag = st.session_state.get("rag")
+    if rag is not None:
+        documents = rag.retriever.vector_db.list_documents()
+        names = document_names()
+        st.session_state.doc_ids = [doc for doc in st.session_state.get("doc_ids", []) if doc in documents]
+        # doc_ids are content hashes: show the file name, plus the id when two files share it
+        labels = list(names.values())
+        st.multiselect("Search in", documents, key="doc_ids", placeholder="All documents",
+                       format_func=lambda doc: (doc if doc not in names else
+                                                names[doc] if labels.count(names[doc]) == 1 else
+                                                f"{names[doc]} ({doc[:8]})"))
+        rag.doc_ids = st.session_state.doc_ids or None
+
     col1, col2, col3 = st.columns([1, 1, 1])
 
     with col2:
         st.button("Clear ↺", on_click=reset_chat)
 
+    report_memory()
+
 # Initialize chat history
 if "messages" not in st.session_state:
     reset_chat()
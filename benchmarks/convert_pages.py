@@ -0,0 +1,45 @@
+# Pages per second of the Docling conversion, sequential vs. page-parallel with
+# an increasing number of worker processes (CPU only).
+#
+#   python -m benchmarks.convert_pages --pdf docs/ricettario1.pdf --workers 1 2 4 8
+
+import argparse
+import time
+
+from src.retrieval.utils import convert_pdf, prewarm_converter, default_pipeline_options
+from src.retrieval.parallel_convert import convert_pdf_parallel, get_pool, shutdown_pool, page_count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", default="docs/ricettario1.pdf")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    args = parser.parse_args()
+
+    options = default_pipeline_options()
+    n_pages = page_count(args.pdf)
+    print(f"{args.pdf}: {n_pages} pages")
+
+    # model loading is excluded: the converters are warm in the app as well
+    prewarm_converter(options)
+    started_at = time.perf_counter()
+    convert_pdf(args.pdf, options)
+    elapsed = time.perf_counter() - started_at
+    print(f"sequential: {elapsed:.1f}s, {n_pages / elapsed:.2f} pages/s")
+
+    for workers in args.workers:
+        pool = get_pool(workers, options)
+        # start every worker process (and load its models) before timing
+        for future in [pool.submit(prewarm_converter, options) for _ in range(workers)]:
+            future.result()
+
+        started_at = time.perf_counter()
+        convert_pdf_parallel(args.pdf, options, workers=workers, pages_per_task=args.pages_per_task)
+        elapsed = time.perf_counter() - started_at
+        print(f"workers={workers}: {elapsed:.1f}s, {n_pages / elapsed:.2f} pages/s")
+        shutdown_pool(workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Local OpenAI-compatible chat completions server for deterministic load tests.
+#
+#   FAKE_LLM_TTFT=0.4 FAKE_LLM_TOKENS_PER_SECOND=50 uvicorn benchmarks.fake_llm_server:app --port 8001
+#   OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=fake streamlit run app.py
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+TTFT = float(os.getenv("FAKE_LLM_TTFT", 0.3))                       # seconds before the first token
+TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 60))
+COMPLETION_TOKENS = int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", 300))
+ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", 0.0))          # share of requests answered with a 5xx
+ERROR_STATUS = int(os.getenv("FAKE_LLM_ERROR_STATUS", 503))
+STALL_RATE = float(os.getenv("FAKE_LLM_STALL_RATE", 0.0))          # share of requests that never answer in time
+SEED = int(os.getenv("FAKE_LLM_SEED", 0))
+
+ANSWER = (
+    "**Risotto alla milanese**\n\n**Ingredienti**\n- riso Carnaroli 320 g\n- brodo di carne 1 l\n"
+    "- zafferano in pistilli 1 bustina\n- burro 80 g\n- cipolla 1\n- Grana Padano grattugiato 60 g\n\n"
+    "**Preparazione**\n1. Tritare la cipolla e farla appassire in metà del burro.\n"
+    "2. Tostare il riso, poi bagnare con il brodo caldo un mestolo alla volta.\n"
+    "3. A metà cottura aggiungere lo zafferano sciolto in poco brodo.\n"
+    "4. A fine cottura mantecare con il burro rimasto e il formaggio.\n"
+).split(" ")
+
+app = FastAPI()
+rng = random.Random(SEED)
+stats = {"requests": 0, "errors": 0, "stalls": 0}
+
+
+def count_tokens(messages):
+    # close enough for accounting, the real tokenizer is not needed here
+    return sum(len(str(message.get("content", "")).split()) for message in messages)
+
+
+def chunk(completion_id, model, delta=None, finish_reason=None, usage=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if usage else [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}],
+        "usage": usage,
+    }
+
+
+def answer_tokens(max_tokens=None):
+    n = min(COMPLETION_TOKENS, max_tokens) if max_tokens else COMPLETION_TOKENS
+    return [ANSWER[i % len(ANSWER)] + " " for i in range(n)]
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "fake-llm", "object": "model", "owned_by": "local"}]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+
+    roll = rng.random()
+    if roll < ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "injected error", "type": "server_error"}}, status_code=ERROR_STATUS)
+    if roll < ERROR_RATE + STALL_RATE:
+        stats["stalls"] += 1
+        await asyncio.sleep(3600)
+
+    model = body.get("model") or "fake-llm"
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    tokens = answer_tokens(body.get("max_completion_tokens") or body.get("max_tokens"))
+    usage = {
+        "prompt_tokens": count_tokens(body.get("messages", [])),
+        "completion_tokens": len(tokens),
+        "total_tokens": count_tokens(body.get("messages", [])) + len(tokens),
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+    if not body.get("stream"):
+        await asyncio.sleep(TTFT + len(tokens) / TOKENS_PER_SECOND)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        await asyncio.sleep(TTFT)
+        yield f"data: {json.dumps(chunk(completion_id, model, delta={'role': 'assistant', 'content': ''}))}\n\n"
+        for token in tokens:
+            yield f"data: {json.dumps(chunk(completion_id, model, delta={'content': token}))}\n\n"
+            await asyncio.sleep(1 / TOKENS_PER_SECOND)
+        yield f"data: {json.dumps(chunk(completion_id, model, finish_reason='stop'))}\n\n"
+        if include_usage:
+            yield f"data: {json.dumps(chunk(completion_id, model, usage=usage))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
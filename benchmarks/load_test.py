@@ -0,0 +1,87 @@
+# End-to-end load test of retrieval + streaming through the async query path.
+# Point the app at the fake server to measure our own overhead offline:
+#
+#   uvicorn benchmarks.fake_llm_server:app --port 8001
+#   OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=fake OPENAI_DEPLOYMENT_NAME=fake-llm \
+#       python -m benchmarks.load_test --name ricettario1 --concurrency 16 --requests 200
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from src.retrieval.chunk_embed import EmbedData
+from src.retrieval.index import QdrantVDB
+from src.retrieval.retriever import Retriever
+from src.retrieval.jobs import doc_ids_for
+from src.retrieval.rag_engine import RAG
+from benchmarks.ttft import QUERIES
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def session(retriever, doc_ids, queue, results):
+    # one RAG per simulated chat session, as in the app
+    rag = RAG(retriever, doc_ids=doc_ids)
+    while True:
+        try:
+            i = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        started_at = time.perf_counter()
+        try:
+            stream = await rag.aquery(QUERIES[i % len(QUERIES)], difficulty="medium")
+            async for _ in stream:
+                pass
+        except Exception as e:
+            results.append({"error": repr(e)})
+            continue
+        finally:
+            rag.history.clear()
+
+        stats = dict(rag.last_stream_stats or {})
+        stats["latency"] = time.perf_counter() - started_at
+        results.append(stats)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--name", default="ricettario1", help="file name (without .pdf) of the document to query")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    retriever = Retriever(QdrantVDB(), embeddata=EmbedData())
+    doc_ids = doc_ids_for(args.name) or [args.name]
+
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    results = []
+    started_at = time.perf_counter()
+    await asyncio.gather(*(session(retriever, doc_ids, queue, results) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    ok = [r for r in results if "error" not in r and r.get("end_to_end_ttft") is not None]
+    errors = len(results) - len(ok)
+    print(f"{len(results)} requests in {elapsed:.2f}s ({len(results) / elapsed:.2f} req/s), {errors} failed")
+    if not ok:
+        return
+
+    for key in ("end_to_end_ttft", "ttft", "latency", "tokens_per_second"):
+        values = [r[key] for r in ok if r.get(key) is not None]
+        print(f"{key:>18}: p50 {percentile(values, 0.5):.3f}  p95 {percentile(values, 0.95):.3f}  "
+              f"mean {statistics.mean(values):.3f}")
+
+    # time spent before the LLM request: embedding, search, context and prompt assembly
+    overhead = [r["end_to_end_ttft"] - r["ttft"] for r in ok]
+    print(f"{'pre-LLM overhead':>18}: p50 {percentile(overhead, 0.5):.3f}  p95 {percentile(overhead, 0.95):.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+# Compares time-to-first-token of the serial query path against the speculative one.
+#
+#   python -m benchmarks.ttft --name ricettario1 --runs 5
+
+import argparse
+import statistics
+import time
+
+from src.retrieval.chunk_embed import EmbedData
+from src.retrieval.index import QdrantVDB
+from src.retrieval.retriever import Retriever
+from src.retrieval.jobs import doc_ids_for
+from src.retrieval.rag_engine import RAG
+
+
+QUERIES = [
+    "cosa posso cucinare con porri e pomodori confit?",
+    "come si prepara il risotto alla milanese?",
+    "una ricetta di dolce con le mele",
+]
+
+
+def run(rag, runs, idle):
+    e2e, ttft = [], []
+    for i in range(runs):
+        query = QUERIES[i % len(QUERIES)]
+        for _ in rag.query(query, difficulty="medium"):
+            pass
+        rag.history.clear()
+        # let the pooled connection expire, as between two questions of a real user
+        time.sleep(idle)
+        e2e.append(rag.last_stream_stats["end_to_end_ttft"])
+        ttft.append(rag.last_stream_stats["ttft"])
+    return e2e, ttft
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--name", default="ricettario1", help="file name (without .pdf) of the document to query")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=0.0, help="seconds to wait between queries")
+    args = parser.parse_args()
+
+    retriever = Retriever(QdrantVDB(), embeddata=EmbedData())
+    # doc_ids are content hashes; documents ingested before that are still found by name
+    doc_ids = doc_ids_for(args.name) or [args.name]
+
+    for speculative in (False, True):
+        # a fresh RAG per mode, so both start with a cold connection pool.
+        # Not coalesced: the queries are sequential and the timings should be the plain streaming path
+        rag = RAG(retriever, speculative=speculative, coalesce=False, doc_ids=doc_ids)
+        e2e, ttft = run(rag, args.runs, args.idle)
+        print(f"speculative={speculative}: end-to-end TTFT median {statistics.median(e2e):.3f}s "
+              f"(mean {statistics.mean(e2e):.3f}s), LLM TTFT median {statistics.median(ttft):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
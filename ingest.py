@@ -0,0 +1,76 @@
+# Ingests every PDF of a directory into the shared collection.
+#
+#   python ingest.py docs/ --workers 2
+#
+# Runs on the same job table as the app (jobs.db): documents already ingested
+# are skipped by content hash, failed ones and the ones left unfinished by a process
+# that is gone are started again. Jobs the app is running are left to it.
+
+import os
+import sys
+import time
+import argparse
+
+from src.retrieval.jobs import JobQueue, STAGES
+
+
+def print_summary(jobs):
+    stages = [stage for stage in STAGES if stage not in ("queued", "done")]
+    header = f"{'document':<30} {'status':<8}" + "".join(f"{stage:>12}" for stage in stages) + f"{'total':>10}"
+    print("\n" + header)
+    print("-" * len(header))
+    for job in jobs:
+        timings = job["timings"]
+        row = f"{job['name'][:30]:<30} {job['status']:<8}"
+        row += "".join(f"{timings[stage]:>11.1f}s" if stage in timings else f"{'-':>12}" for stage in stages)
+        row += f"{sum(timings.values()):>9.1f}s"
+        print(row)
+        if job["error"]:
+            print(f"    {job['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="directory with the PDFs to ingest")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", 1)),
+                        help="documents converted and embedded at the same time")
+    parser.add_argument("--db", default="jobs.db")
+    args = parser.parse_args()
+
+    pdf_paths = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory)
+                       if name.lower().endswith(".pdf"))
+    if not pdf_paths:
+        sys.exit(f"no PDF in {args.directory}")
+
+    # every worker loads the Docling and embedding models once and keeps them for its next documents.
+    # No resume: only the documents of this directory are (re)started, by submit
+    queue = JobQueue(db_path=args.db, max_workers=args.workers, resume=False, prewarm=True)
+
+    job_ids = []
+    for pdf_path in pdf_paths:
+        with open(pdf_path, "rb") as f:
+            job_id = queue.submit(f.read(), os.path.basename(pdf_path))
+        job_ids.append(job_id)
+        job = queue.get(job_id)
+        print(f"{os.path.basename(pdf_path)}: {'already ingested' if job['status'] == 'done' else job['status']}")
+
+    last = {}
+    while True:
+        jobs = [queue.get(job_id) for job_id in job_ids]
+        for job in jobs:
+            state = (job["status"], job["stage"])
+            if last.get(job["id"]) != state:
+                last[job["id"]] = state
+                print(f"[{time.strftime('%H:%M:%S')}] {job['name']}: {job['stage']} ({job['status']}, {job['progress']}%)")
+        if all(job["status"] in ("done", "failed") for job in jobs):
+            break
+        time.sleep(1)
+
+    queue.pool.shutdown(wait=False, cancel_futures=True)
+    print_summary(jobs)
+    if any(job["status"] == "failed" for job in jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import io
+import os
+import glob
+import json
+import shutil
+import hashlib
+from importlib.metadata import version
+
+from docling_core.types.doc import DoclingDocument, ImageRefMode
+
+from src.retrieval.utils import convert_pdf, export_pages, default_pipeline_options, IMAGE_PLACEHOLDER
+from src.retrieval.parallel_convert import convert_pdf_parallel, convert_pdf_adaptive
+
+
+def pdf_hash(pdf_path):
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def options_hash(pipeline_options, adaptive=False, keep_images=False):
+    # a different docling version may convert the same PDF differently
+    options = pipeline_options.model_dump_json() + version("docling")
+    if adaptive:
+        options += "adaptive" + ("+images" if keep_images else "")
+    return hashlib.sha256(options.encode("utf-8")).hexdigest()[:16]
+
+
+class ArtifactStore:
+    """
+    Docling conversions on disk, addressed by PDF content hash and pipeline options:
+
+        artifacts/<pdf hash>/<options key>/document-0001.json   the DoclingDocument, one part
+                                                                  per page range when converted in parallel
+                                           /pages.json           [[page_no, markdown], ...], with image placeholders
+                                           /images.json          [[page_no, "images/<sha256>.png"], ...]
+                                           /images/              the pictures, in reading order
+                                           /document.md          the whole markdown
+
+    Chunking and embedding experiments reuse them instead of converting again.
+    """
+    def __init__(self, root="artifacts"):
+        self.root = root
+
+    def path(self, content_hash, options_key):
+        return os.path.join(self.root, content_hash, options_key)
+
+    def has(self, content_hash, options_key):
+        return os.path.isfile(os.path.join(self.path(content_hash, options_key), "pages.json"))
+
+    def load_images(self, content_hash, options_key):
+        path = self.path(content_hash, options_key)
+        if not os.path.isfile(os.path.join(path, "images.json")):
+            return []
+        with open(os.path.join(path, "images.json"), encoding="utf-8") as f:
+            return [(page_no, os.path.join(path, image_path)) for page_no, image_path in json.load(f)]
+
+    def load_pages(self, content_hash, options_key):
+        with open(os.path.join(self.path(content_hash, options_key), "pages.json"), encoding="utf-8") as f:
+            return [tuple(page) for page in json.load(f)]
+
+    def load_documents(self, content_hash, options_key):
+        parts = sorted(glob.glob(os.path.join(self.path(content_hash, options_key), "document-*.json")))
+        return [DoclingDocument.load_from_json(part) for part in parts]
+
+    def load_markdown(self, content_hash, options_key):
+        with open(os.path.join(self.path(content_hash, options_key), "document.md"), encoding="utf-8") as f:
+            return f.read()
+
+    def save(self, content_hash, options_key, documents, pages):
+        path = self.path(content_hash, options_key)
+        # written aside and renamed, so a crash never leaves a half-written artifact behind
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        for document in documents:
+            # parts are named after their first page
+            first_page = min(document.pages) if document.pages else 0
+            # pictures are saved once under images/, not inline as base64
+            document.save_as_json(os.path.join(tmp_path, f"document-{first_page:04d}.json"),
+                                  image_mode=ImageRefMode.PLACEHOLDER)
+        images = self.save_images(tmp_path, documents)
+        with open(os.path.join(tmp_path, "images.json"), "w", encoding="utf-8") as f:
+            json.dump(images, f)
+        with open(os.path.join(tmp_path, "pages.json"), "w", encoding="utf-8") as f:
+            json.dump(pages, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "document.md"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(markdown_text.replace(IMAGE_PLACEHOLDER, "") for _, markdown_text in pages))
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # converted at the same time by another worker: keep theirs
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @staticmethod
+    def save_images(path, documents):
+        # only pictures rendered by the pipeline (generate_picture_images) have an image
+        images = []
+        os.makedirs(os.path.join(path, "images"), exist_ok=True)
+        for document in documents:
+            for picture in document.pictures:
+                image = picture.get_image(document)
+                if image is None:
+                    continue
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+                data = buffer.getvalue()
+                image_path = os.path.join("images", f"{hashlib.sha256(data).hexdigest()}.png")
+                with open(os.path.join(path, image_path), "wb") as f:
+                    f.write(data)
+                images.append((picture.prov[0].page_no if picture.prov else None, image_path))
+        return images
+
+    def convert(self, pdf_path, pipeline_options=None, content_hash=None, workers=1, adaptive=False,
+                keep_images=False, with_images=False):
+        """
+        Per-page markdown of a PDF, converted only if this PDF was never
+        converted with these options. Returns [(page_no, markdown), ...].
+        With workers > 1 page ranges are converted in parallel processes;
+        adaptive skips OCR on pages with a text layer, and image rendering unless keep_images.
+        with_images keeps the image placeholders and also returns [(page_no, png path), ...].
+        """
+        pipeline_options = pipeline_options or default_pipeline_options()
+        content_hash = content_hash or pdf_hash(pdf_path)
+        options_key = options_hash(pipeline_options, adaptive, keep_images)
+
+        if self.has(content_hash, options_key):
+            print(f"Reusing the conversion of {pdf_path}")
+        else:
+            self._convert(pdf_path, pipeline_options, content_hash, options_key, workers, adaptive, keep_images)
+
+        pages = self.load_pages(content_hash, options_key)
+        if with_images:
+            return pages, self.load_images(content_hash, options_key)
+        return [(page_no, page_text.replace(IMAGE_PLACEHOLDER, "")) for page_no, page_text in pages]
+
+    def _convert(self, pdf_path, pipeline_options, content_hash, options_key, workers, adaptive, keep_images):
+        if adaptive:
+            documents, pages = convert_pdf_adaptive(pdf_path, keep_images=keep_images, workers=workers)
+        elif workers > 1:
+            documents, pages = convert_pdf_parallel(pdf_path, pipeline_options, workers=workers)
+        else:
+            document = convert_pdf(pdf_path, pipeline_options)
+            documents, pages = [document], export_pages(document)
+        self.save(content_hash, options_key, documents, pages)
@@ -1,7 +1,9 @@
 import pickle
+import bisect
 from transformers import AutoTokenizer
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from tqdm import tqdm
+from src.retrieval.metadata import heading_spans, detect_courses, detect_ingredients
 
 
 # --------- Chunking ---------
@@ -19,6 +21,95 @@ def chunk_markdown(text: str, model_name="nomic-ai/nomic-embed-text-v1.5", token
     return chunks
 
 
+def get_tokenizer(model_name=None):
+    return AutoTokenizer.from_pretrained(model_name or "nomic-ai/nomic-embed-text-v1.5")
+
+
+def encode_page(page_text, tokenizer):
+    """
+    Token ids of a page, as chunk_pages concatenates them, and its headings as
+    (token offset, heading). Headings are read from the markdown before tokenization:
+    the decoded chunks are lowercased and without newlines.
+    """
+    text = page_text + "\n\n"
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    starts = [start for start, _ in encoding["offset_mapping"]]
+    headings = [(bisect.bisect_left(starts, offset), heading) for offset, heading in heading_spans(text)]
+    return encoding["input_ids"], headings
+
+
+def encode_pages(pages, tokenizer):
+    # page_no -> (token ids, headings) of the page, see encode_page
+    return {page_no: encode_page(page_text, tokenizer) for page_no, page_text in pages}
+
+
+def chunk_pages(pages, model_name="nomic-ai/nomic-embed-text-v1.5", token_limit=1024, stride=100,
+                tokenizer=None, encoded=None, per_page=False, sections=None):
+    """
+    Same sliding window as chunk_markdown over the concatenated pages, but every
+    chunk keeps its metadata: page span, headings and detected course/ingredient tags.
+    Pages already in encoded (see encode_pages) are not tokenized again.
+    With per_page the window restarts at every page, so a chunk never spans two pages.
+    The pages need not be contiguous then: sections (page_no -> heading in effect
+    where the page starts) gives the section a page opens in, otherwise it is only
+    carried over from the page right before it.
+    Returns (chunk texts, chunk metadata).
+    """
+    tokenizer = tokenizer or get_tokenizer(model_name)
+    encoded = encoded or {}
+
+    segments = []
+    first_pages = []
+    for page_no, page_text in pages:
+        page_ids, page_headings = encoded.get(page_no) or encode_page(page_text, tokenizer)
+        if per_page or not segments:
+            segments.append(([], [], []))
+        input_ids, token_pages, headings = segments[-1]
+        if per_page:
+            first_pages.append(page_no)
+        headings.extend((len(input_ids) + offset, heading) for offset, heading in page_headings)
+        input_ids.extend(page_ids)
+        token_pages.extend([page_no] * len(page_ids))
+
+    chunks = []
+    metadata = []
+    section = None
+    for n, (input_ids, token_pages, headings) in enumerate(segments):
+        if per_page:
+            page_no = first_pages[n]
+            if sections is not None:
+                section = sections.get(page_no)
+            elif n == 0 or first_pages[n - 1] != page_no - 1:
+                # a page whose previous page is not chunked here: its section is unknown
+                section = None
+        offsets = [offset for offset, _ in headings]
+        for i in range(0, len(input_ids), token_limit - stride):
+            chunk_text = tokenizer.decode(input_ids[i:i + token_limit])
+            chunk_pages_no = token_pages[i:i + token_limit]
+
+            # the section the chunk starts in, then the headings it contains
+            first, last = bisect.bisect_left(offsets, i), bisect.bisect_left(offsets, i + token_limit)
+            if first:
+                section = headings[first - 1][1]
+            chunk_headings = ([section] if section else []) + [heading for _, heading in headings[first:last]]
+            chunk_headings = list(dict.fromkeys(chunk_headings))
+
+            chunks.append(chunk_text)
+            metadata.append({
+                "page_start": chunk_pages_no[0],
+                "page_end": chunk_pages_no[-1],
+                "headings": chunk_headings,
+                "course": detect_courses(chunk_text, chunk_headings),
+                "ingredients": detect_ingredients(chunk_text),
+            })
+        if headings:
+            # the next page opens in the last section of this one
+            section = headings[-1][1]
+
+    print(f"Total chunks created: {len(chunks)}")
+    return chunks, metadata
+
+
 # --------- Embedding ---------
 def batch_iterate(lst, batch_size):
     for i in range(0, len(lst), batch_size):
@@ -26,12 +117,15 @@ def batch_iterate(lst, batch_size):
 
 
 class EmbedData:
-    def __init__(self, embed_model_name="nomic-ai/nomic-embed-text-v1.5", batch_size=8):
+    def __init__(self, embed_model_name="nomic-ai/nomic-embed-text-v1.5", batch_size=8, embed_model=None):
         self.embed_model_name = embed_model_name
-        self.embed_model = self._load_embed_model()
+        # an already loaded model can be shared between instances
+        self.embed_model = embed_model or self._load_embed_model()
         self.batch_size = batch_size
         self.embeddings = []
         self.contexts = []
+        # per-chunk payload metadata (pages, headings, tags), parallel to contexts
+        self.metadata = []
 
     def _load_embed_model(self):
         return HuggingFaceEmbedding(model_name=self.embed_model_name,
@@ -41,31 +135,36 @@ class EmbedData:
     def generate_embedding(self, contexts):
         return self.embed_model.get_text_embedding_batch(contexts)
 
-    def embed(self, contexts):
+    def embed(self, contexts, progress_callback=None):
         self.contexts = contexts
-        for batch_context in tqdm(batch_iterate(contexts, self.batch_size),
-                                  total=(len(contexts) + self.batch_size - 1) // self.batch_size,
-                                  desc="Embedding data in batches"):
+        total = (len(contexts) + self.batch_size - 1) // self.batch_size
+        for i, batch_context in enumerate(tqdm(batch_iterate(contexts, self.batch_size),
+                                               total=total,
+                                               desc="Embedding data in batches")):
             batch_embeddings = self.generate_embedding(batch_context)
             self.embeddings.extend(batch_embeddings)
+            if progress_callback:
+                progress_callback(i + 1, total)
 
 
 # --------- Save / Load ---------
 def save_embeddings(embeddata, filename):
     data = {
         "contexts": embeddata.contexts,
-        "embeddings": embeddata.embeddings
+        "embeddings": embeddata.embeddings,
+        "metadata": embeddata.metadata
     }
     with open(filename, "wb") as f:
         pickle.dump(data, f)
     print(f"Embeddings saved to {filename}")
 
 
-def load_embeddings(filename, embed_model_name="nomic-ai/nomic-embed-text-v1.5", batch_size=8):
+def load_embeddings(filename, embed_model_name="nomic-ai/nomic-embed-text-v1.5", batch_size=8, embed_model=None):
     with open(filename, "rb") as f:
         data = pickle.load(f)
 
-    embeddata = EmbedData(embed_model_name=embed_model_name, batch_size=batch_size)
+    embeddata = EmbedData(embed_model_name=embed_model_name, batch_size=batch_size, embed_model=embed_model)
     embeddata.contexts = data["contexts"]
     embeddata.embeddings = data["embeddings"]
+    embeddata.metadata = data.get("metadata", [])
     return embeddata
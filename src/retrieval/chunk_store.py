@@ -0,0 +1,66 @@
+import os
+import sqlite3
+
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chunks (
+        id TEXT PRIMARY KEY,
+        doc_id TEXT,
+        text TEXT NOT NULL
+    )
+"""
+
+
+class ChunkStore:
+    """
+    Chunk text kept next to the app instead of in the Qdrant payload.
+    The vector search only returns ids and small metadata, the text is
+    read from here by id for the chunks that are actually used.
+    """
+    def __init__(self, db_path="chunks.db"):
+        self.db_path = db_path
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+
+    def connect(self):
+        # one connection per call: the store is used from Streamlit threads, API workers and ingest processes
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def put_many(self, ids, texts, doc_id=None):
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, doc_id, text) VALUES (?, ?, ?)",
+                [(str(chunk_id), doc_id, text) for chunk_id, text in zip(ids, texts)],
+            )
+
+    def get_many(self, ids):
+        ids = [str(chunk_id) for chunk_id in ids]
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" * len(ids))
+        with self.connect() as conn:
+            rows = conn.execute(f"SELECT id, text FROM chunks WHERE id IN ({placeholders})", ids).fetchall()
+        return dict(rows)
+
+    def delete_many(self, ids):
+        ids = [str(chunk_id) for chunk_id in ids]
+        if not ids:
+            return
+        with self.connect() as conn:
+            conn.execute(f"DELETE FROM chunks WHERE id IN ({', '.join('?' * len(ids))})", ids)
+
+    def count_document(self, doc_id):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM chunks WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+
+    def delete_document(self, doc_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+
+
+def default_chunk_store():
+    # opt-in: with CHUNK_STORE_PATH set, new chunks keep their text out of Qdrant
+    db_path = os.getenv("CHUNK_STORE_PATH")
+    return ChunkStore(db_path) if db_path else None
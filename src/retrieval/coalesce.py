@@ -0,0 +1,88 @@
+import threading
+
+
+class Flight:
+    """
+    One upstream answer shared by every consumer that asked the same question
+    while it was in flight. Pieces are kept so late joiners replay from the start.
+    """
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        # the producer stopped at the LLM deadline: the answer is cut short
+        self.expired = False
+        self.subscribers = 0
+        # when the producer sent the completion request, for the consumers' ttft
+        self.started_at = None
+        self.cond = threading.Condition()
+
+    def publish(self, piece):
+        with self.cond:
+            self.pieces.append(piece)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def subscribe(self):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.pieces) and not self.done:
+                    self.cond.wait()
+                pieces = self.pieces[i:]
+                done = self.done
+
+            yield from pieces
+            i += len(pieces)
+
+            if done and i >= len(self.pieces):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Returns the in-flight answer for key and whether the caller is the
+        leader, i.e. the one that has to produce it.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self.flights[key] = flight
+            flight.subscribers += 1
+            return flight, leader
+
+    def leave(self, key, flight):
+        with self.lock:
+            flight.subscribers -= 1
+            if flight.subscribers == 0:
+                # nobody is listening anymore: the producer can stop early
+                flight.cancelled = True
+                self._forget(key, flight)
+
+    def forget(self, key, flight):
+        # once the answer is complete, new askers start a fresh flight
+        with self.lock:
+            self._forget(key, flight)
+
+    def _forget(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+# process-wide, so identical questions from different sessions are coalesced
+inflight_queries = SingleFlight()
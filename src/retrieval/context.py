@@ -0,0 +1,120 @@
+import os
+import re
+import tiktoken
+
+
+# A sentence ends at . ! ? followed by whitespace, or at a newline (markdown lines, list items)
+SENTENCE_PATTERN = re.compile(r'.*?(?:[.!?](?=\s)|\n|$)\s*', re.S)
+
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+class ApproximateEncoding:
+    """
+    Stand-in for a tiktoken encoding when its BPE file cannot be loaded (offline,
+    nothing cached): one "token" every 4 characters, about the o200k rate on Italian text.
+    """
+    name = "approximate"
+
+    def __init__(self, chars_per_token=4):
+        self.chars_per_token = chars_per_token
+
+    def encode(self, text, disallowed_special=()):
+        return [text[i:i + self.chars_per_token] for i in range(0, len(text), self.chars_per_token)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class ContextBuilder:
+    def __init__(self, model_name=None, token_budget=3000, separator="\n\n---\n\n", min_dedup_chars=24):
+        self.token_budget = token_budget
+        self.separator = separator
+        # short lines ("Ingredienti", "- uova") legitimately repeat across recipes
+        self.min_dedup_chars = min_dedup_chars
+        self.encoding = self._load_encoding(model_name)
+
+    def _load_encoding(self, model_name):
+        # BPE files are downloaded once into ./tiktoken_cache and read from there afterwards
+        os.environ.setdefault("TIKTOKEN_CACHE_DIR", "tiktoken_cache")
+        try:
+            if model_name:
+                try:
+                    return tiktoken.encoding_for_model(model_name)
+                except KeyError:
+                    pass
+            # no model or an arbitrary Azure deployment name: the GPT-4o/GPT-5 encoding
+            return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # offline without a cached BPE file: budgets are approximate, but nothing breaks
+            print(f"Tokenizer encoding not available ({type(e).__name__}), counting tokens approximately")
+            return ApproximateEncoding()
+
+    def count_tokens(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def build(self, points):
+        """
+        Packs the retrieved chunks by score until the token budget is reached.
+        - Sentences already present in a higher-scored chunk (chunk overlap) are dropped.
+        - The last chunk that does not fit is truncated at a sentence boundary.
+        Returns the context string and the token statistics for the request.
+        """
+        ranked = sorted(points, key=lambda point: point.score, reverse=True)
+        separator_tokens = self.count_tokens(self.separator)
+
+        stats = {
+            "token_budget": self.token_budget,
+            "candidate_chunks": len(ranked),
+            "candidate_tokens": 0,
+            "context_tokens": 0,
+            "chunks_used": 0,
+            "chunks_truncated": 0,
+            "sentences_deduplicated": 0,
+        }
+
+        parts = []
+        seen_text = ""
+        used_tokens = 0
+        budget_reached = False
+
+        for point in ranked:
+            chunk_text = point.payload["context"]
+            stats["candidate_tokens"] += self.count_tokens(chunk_text)
+            if budget_reached:
+                continue
+
+            kept = []
+            for sentence in split_sentences(chunk_text):
+                key = normalize(sentence)
+                if len(key) >= self.min_dedup_chars and key in seen_text:
+                    stats["sentences_deduplicated"] += 1
+                    continue
+
+                cost = self.count_tokens(sentence)
+                if not kept and parts:
+                    cost += separator_tokens
+                if used_tokens + cost > self.token_budget:
+                    budget_reached = True
+                    if kept:
+                        stats["chunks_truncated"] += 1
+                    break
+
+                kept.append(sentence)
+                used_tokens += cost
+                seen_text += key + "\n"
+
+            if kept:
+                parts.append("".join(kept).strip())
+                stats["chunks_used"] += 1
+
+        context = self.separator.join(parts)
+        stats["context_tokens"] = self.count_tokens(context)
+
+        return context, stats
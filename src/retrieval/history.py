@@ -0,0 +1,84 @@
+TRUNCATION_MARKER = " [...]"
+
+
+class ConversationHistory:
+    def __init__(self, count_tokens, max_tokens=1500, max_message_tokens=600, summarizer=None, encoding=None):
+        self.count_tokens = count_tokens
+        # tokenizer encoding (encode/decode), to cut text without spaces by token ids
+        self.encoding = encoding
+        self.max_tokens = max_tokens
+        self.max_message_tokens = max_message_tokens
+        # summarizer(previous_summary, dropped_messages) -> new summary, or None to just drop
+        self.summarizer = summarizer
+
+        self.turns = []
+        self.summary = None
+
+    def add(self, role, content):
+        tokens = self.count_tokens(content)
+        if self.max_message_tokens and tokens > self.max_message_tokens:
+            # keep the head of long replies (title + ingredients), the rest is rarely needed
+            content = self._truncate(content, self.max_message_tokens)
+            tokens = self.count_tokens(content)
+
+        self.turns.append({"role": role, "content": content, "tokens": tokens})
+        self._trim()
+
+    def clear(self):
+        self.turns = []
+        self.summary = None
+
+    def total_tokens(self):
+        summary_tokens = self.count_tokens(self.summary) if self.summary else 0
+        return summary_tokens + sum(turn["tokens"] for turn in self.turns)
+
+    def messages(self):
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Riassunto della conversazione precedente: {self.summary}"})
+        messages.extend({"role": turn["role"], "content": turn["content"]} for turn in self.turns)
+        return messages
+
+    def _trim(self):
+        dropped = []
+        while self.turns and sum(turn["tokens"] for turn in self.turns) > self.max_tokens:
+            dropped.append(self.turns.pop(0))
+
+        # never start the window with an assistant reply
+        while self.turns and self.turns[0]["role"] == "assistant":
+            dropped.append(self.turns.pop(0))
+
+        if dropped and self.summarizer:
+            self.summary = self.summarizer(self.summary, [{"role": turn["role"], "content": turn["content"]}
+                                                          for turn in dropped])
+
+    def _truncate(self, text, max_tokens):
+        # the marker is part of the stored message, so it counts against the cap
+        budget = max(max_tokens - self.count_tokens(TRUNCATION_MARKER), 0)
+        words = text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:mid])) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        head = " ".join(words[:low])
+
+        if not head.strip():
+            # a first "word" longer than the budget (URLs, tables, base64): cut inside it
+            if self.encoding is not None:
+                head = self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:budget])
+                # a cut multi-byte character can decode to more tokens than it was
+                while head and self.count_tokens(head) > budget:
+                    head = head[:-1]
+            else:
+                low, high = 0, len(text)
+                while low < high:
+                    mid = (low + high + 1) // 2
+                    if self.count_tokens(text[:mid]) <= budget:
+                        low = mid
+                    else:
+                        high = mid - 1
+                head = text[:low]
+        return head + TRUNCATION_MARKER
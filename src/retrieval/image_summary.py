@@ -0,0 +1,169 @@
+import os
+import base64
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from src.retrieval.utils import IMAGE_PLACEHOLDER
+from src.retrieval.rag_engine import create_llm_client
+from src.retrieval.chunk_embed import chunk_pages, encode_pages, get_tokenizer
+
+
+CAPTION_PROMPT = ("Descrivi in italiano, in al massimo 2 frasi, questa immagine tratta da un ricettario: "
+                  "il piatto o gli ingredienti mostrati, oppure cosa spiega lo schema.")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS summaries (
+        image_hash TEXT NOT NULL,
+        backend TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        PRIMARY KEY (image_hash, backend)
+    )
+"""
+
+
+# --------- Backends ---------
+class StubCaptioner:
+    """Offline backend, for tests and pipelines without an LLM: no model, deterministic output."""
+    name = "stub"
+
+    def describe(self, images):
+        return [f"Immagine {hashlib.sha256(data).hexdigest()[:8]}" for data in images]
+
+
+class LLMCaptioner:
+    def __init__(self, llm_client=None, model=None, prompt=CAPTION_PROMPT, max_workers=4):
+        # timeouts, retries and circuit breaker of the chat answers (see ResilientLLM)
+        self.llm_client = llm_client or create_llm_client()
+        self.model = model or os.getenv("IMAGE_SUMMARY_MODEL") or os.getenv("OPENAI_DEPLOYMENT_NAME")
+        self.prompt = prompt
+        self.max_workers = max_workers
+        self.name = f"llm:{self.model}"
+
+    def describe(self, images):
+        # the requests of a batch are sent side by side
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self._describe_one, images))
+
+    def _describe_one(self, data):
+        image_url = "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+        response = self.llm_client.create(
+            model=self.model,
+            messages=[{"role": "user", "content": [
+                {"type": "text", "text": self.prompt},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ]}],
+        )
+        return response.choices[0].message.content.strip()
+
+
+BACKENDS = {
+    "stub": StubCaptioner,
+    "llm": LLMCaptioner,
+}
+
+
+# --------- Summarizer ---------
+class ImageSummarizer:
+    """
+    Image -> short description, cached by image hash and backend, so a picture
+    repeated across pages or documents (logos, icons) is described once.
+    """
+    def __init__(self, backend, db_path="image_summaries.db", batch_size=8):
+        self.backend = backend
+        self.db_path = db_path
+        self.batch_size = batch_size
+        with self.connect() as conn:
+            conn.execute(SCHEMA)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def summarize(self, images):
+        """Descriptions of a list of PNG images (bytes), in the same order."""
+        hashes = [hashlib.sha256(data).hexdigest() for data in images]
+
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT image_hash, summary FROM summaries WHERE backend = ? "
+                f"AND image_hash IN ({', '.join('?' * len(hashes))})",
+                (self.backend.name, *hashes),
+            ).fetchall() if hashes else []
+        summaries = dict(rows)
+
+        missing = {}
+        for image_hash, data in zip(hashes, images):
+            if image_hash not in summaries:
+                missing[image_hash] = data
+        print(f"Image summaries: {len(hashes) - len(missing)} cached, {len(missing)} to describe")
+
+        missing = list(missing.items())
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            descriptions = self.backend.describe([data for _, data in batch])
+            with self.connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO summaries (image_hash, backend, summary) VALUES (?, ?, ?)",
+                    [(image_hash, self.backend.name, text) for (image_hash, _), text in zip(batch, descriptions)],
+                )
+            summaries.update((image_hash, text) for (image_hash, _), text in zip(batch, descriptions))
+
+        return [summaries[image_hash] for image_hash in hashes]
+
+    def summarize_files(self, paths):
+        images = []
+        for path in paths:
+            with open(path, "rb") as f:
+                images.append(f.read())
+        return self.summarize(images)
+
+
+def get_image_summarizer():
+    # IMAGE_SUMMARIES=stub|llm turns the stage on, off by default
+    backend = os.getenv("IMAGE_SUMMARIES", "off").lower()
+    if backend not in BACKENDS:
+        return None
+    return ImageSummarizer(BACKENDS[backend](), db_path=os.getenv("IMAGE_SUMMARY_DB", "image_summaries.db"))
+
+
+# --------- Markdown ---------
+def splice_summaries(pages, images, summaries):
+    """
+    Replaces the image placeholders of every page with the descriptions of
+    the pictures of that page, in reading order. Placeholders without a
+    picture image are dropped.
+    """
+    by_page = {}
+    for (page_no, _), summary in zip(images, summaries):
+        by_page.setdefault(page_no, []).append(summary)
+
+    spliced = []
+    for page_no, page_text in pages:
+        parts = page_text.split(IMAGE_PLACEHOLDER)
+        page_summaries = by_page.get(page_no, [])
+        text = parts[0]
+        for i, part in enumerate(parts[1:]):
+            if i < len(page_summaries):
+                text += f"[Immagine: {page_summaries[i]}]"
+            text += part
+        spliced.append((page_no, text))
+    return spliced
+
+
+def summarize_and_chunk(pages, images, summarizer, **chunk_kwargs):
+    """
+    chunk_pages with image descriptions spliced in. The descriptions are
+    computed in a background thread while the pages without pictures are
+    tokenized, then only the pages with pictures are tokenized afterwards.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(summarizer.summarize_files, [path for _, path in images])
+
+        tokenizer = get_tokenizer(chunk_kwargs.get("model_name"))
+        text_only = [(page_no, page_text) for page_no, page_text in pages if IMAGE_PLACEHOLDER not in page_text]
+        encoded = encode_pages(text_only, tokenizer)
+
+        summaries = future.result()
+
+    pages = splice_summaries(pages, images, summaries)
+    return chunk_pages(pages, tokenizer=tokenizer, encoded=encoded, **chunk_kwargs)
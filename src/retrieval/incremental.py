@@ -0,0 +1,193 @@
+import time
+import uuid
+import sqlite3
+import hashlib
+
+import pypdfium2
+
+from src.retrieval.utils import default_pipeline_options, adaptive_pipeline_options, IMAGE_PLACEHOLDER
+from src.retrieval.parallel_convert import convert_ranges, text_layer_pages
+from src.retrieval.chunk_embed import chunk_pages, EmbedData
+from src.retrieval.index import QdrantVDB
+from src.retrieval.metadata import heading_spans
+
+
+# fixed namespace: the same chunk of the same page always gets the same point id
+CHUNK_NAMESPACE = uuid.UUID("6f1c2a8e-3d4b-5c6d-8e9f-0a1b2c3d4e5f")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS doc_pages (
+        doc_id TEXT NOT NULL,
+        page_no INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        chunks INTEGER NOT NULL,
+        section TEXT,
+        PRIMARY KEY (doc_id, page_no)
+    )
+"""
+
+
+def chunk_id(doc_id, page_no, index):
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{doc_id}:{page_no}:{index}"))
+
+
+def page_fingerprints(pdf_path, scale=0.25):
+    """
+    page_no -> hash of the page's text layer and of a low resolution rendering,
+    so that both edited text and edited scans/pictures change it.
+    """
+    fingerprints = {}
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            digest = hashlib.sha256(textpage.get_text_range().encode("utf-8"))
+            textpage.close()
+            bitmap = page.render(scale=scale, grayscale=True)
+            digest.update(bytes(bitmap.buffer))
+            bitmap.close()
+            page.close()
+            fingerprints[i + 1] = digest.hexdigest()
+    finally:
+        pdf.close()
+    return fingerprints
+
+
+class PageManifest:
+    """
+    Fingerprint, chunk count and section (the heading in effect where the page
+    ends) of every ingested page, per document.
+    """
+    def __init__(self, db_path="jobs.db"):
+        self.db_path = db_path
+        with self.connect() as conn:
+            conn.execute(SCHEMA)
+            # manifests written before the section column
+            if "section" not in {row[1] for row in conn.execute("PRAGMA table_info(doc_pages)")}:
+                conn.execute("ALTER TABLE doc_pages ADD COLUMN section TEXT")
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, doc_id):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT page_no, fingerprint, chunks, section FROM doc_pages WHERE doc_id = ?",
+                                (doc_id,)).fetchall()
+        return {page_no: (fingerprint, chunks, section) for page_no, fingerprint, chunks, section in rows}
+
+    def update(self, doc_id, pages, removed=()):
+        # pages: page_no -> (fingerprint, chunks, section)
+        with self.connect() as conn:
+            conn.executemany("DELETE FROM doc_pages WHERE doc_id = ? AND page_no = ?",
+                             [(doc_id, page_no) for page_no in removed])
+            conn.executemany(
+                "INSERT OR REPLACE INTO doc_pages (doc_id, page_no, fingerprint, chunks, section) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(doc_id, page_no, fingerprint, chunks, section)
+                 for page_no, (fingerprint, chunks, section) in pages.items()],
+            )
+
+    def clear(self, doc_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM doc_pages WHERE doc_id = ?", (doc_id,))
+
+
+def page_sections(pages, previous=None):
+    """
+    For pages [(page_no, markdown), ...], in page order and possibly with gaps:
+    the heading in effect where each page starts and where it ends. The sections
+    of the pages that are not given come from previous (page_no -> section at
+    its end, e.g. from the manifest).
+    Returns (starts, ends), both page_no -> heading or None.
+    """
+    ends = dict(previous or {})
+    starts = {}
+    for page_no, page_text in sorted(pages):
+        starts[page_no] = ends.get(page_no - 1)
+        spans = heading_spans(page_text)
+        ends[page_no] = spans[-1][1] if spans else starts[page_no]
+    return starts, ends
+
+
+def page_runs(page_nos, max_pages=8):
+    # consecutive page numbers -> (first, last) ranges of at most max_pages
+    runs = []
+    for page_no in sorted(page_nos):
+        if runs and runs[-1][1] == page_no - 1 and page_no - runs[-1][0] < max_pages:
+            runs[-1] = (runs[-1][0], page_no)
+        else:
+            runs.append((page_no, page_no))
+    return runs
+
+
+def ingest_document(pdf_path, doc_id, embed_model, manifest, source=None, workers=1, adaptive=False,
+                    enter=lambda stage: None):
+    """
+    Ingests a new version of a document touching only the pages that changed:
+    only those are converted, chunked (per page) and embedded, and only their
+    Qdrant points are replaced. A document without a manifest is ingested whole.
+    Returns the stats of the run.
+    """
+    started_at = time.time()
+    new = page_fingerprints(pdf_path)
+    old = manifest.get(doc_id)
+
+    changed = [page_no for page_no, fingerprint in new.items() if old.get(page_no, (None,))[0] != fingerprint]
+    removed = [page_no for page_no in old if page_no not in new]
+    stats = {"pages": len(new), "changed_pages": len(changed), "removed_pages": len(removed), "chunks": 0}
+    print(f"{doc_id}: {len(changed)}/{len(new)} pages changed, {len(removed)} removed")
+    if not changed and not removed:
+        vector_db = QdrantVDB()
+        stats["collection_name"] = vector_db.collection_name
+        stats["vector_dim"] = vector_db.client.get_collection(vector_db.collection_name).config.params.vectors.size
+        return stats
+
+    enter("converting")
+    if adaptive:
+        digital = text_layer_pages(pdf_path)
+        without_ocr, with_ocr = adaptive_pipeline_options(do_ocr=False), adaptive_pipeline_options(do_ocr=True)
+        tasks = ([(first, last, without_ocr) for first, last in page_runs(p for p in changed if p in digital)] +
+                 [(first, last, with_ocr) for first, last in page_runs(p for p in changed if p not in digital)])
+    else:
+        pipeline_options = default_pipeline_options()
+        tasks = [(first, last, pipeline_options) for first, last in page_runs(changed)]
+    _, pages = convert_ranges(pdf_path, tasks, workers=workers) if tasks else ([], [])
+    pages = [(page_no, page_text.replace(IMAGE_PLACEHOLDER, "")) for page_no, page_text in pages]
+
+    enter("chunking")
+    # changed pages may be far apart: each one opens in the section its previous page ends in
+    starts, ends = page_sections(pages, {page_no: entry[2] for page_no, entry in old.items()})
+    chunks, metadata = chunk_pages(pages, per_page=True, sections=starts) if pages else ([], [])
+    ids, counts = [], {page_no: 0 for page_no in changed}
+    for chunk_metadata in metadata:
+        page_no = chunk_metadata["page_start"]
+        ids.append(chunk_id(doc_id, page_no, counts[page_no]))
+        counts[page_no] += 1
+
+    enter("embedding")
+    embeddata = EmbedData(batch_size=8, embed_model=embed_model)
+    embeddata.metadata = metadata
+    if chunks:
+        embeddata.embed(chunks)
+
+    enter("indexing")
+    vector_db = QdrantVDB(vector_dim=len(embeddata.embeddings[0]) if chunks else 768, batch_size=7)
+    vector_db.create_collection()
+    if not old:
+        # points of an earlier, non incremental ingestion have random ids: start from scratch
+        vector_db.delete_document(doc_id)
+    stale_ids = [chunk_id(doc_id, page_no, i) for page_no in changed + removed
+                 for i in range(old.get(page_no, (None, 0))[1])]
+    vector_db.delete_pages(doc_id, changed + removed, chunk_ids=stale_ids)
+    if chunks:
+        vector_db.ingest_data(embeddata, doc_id=doc_id, source=source, ids=ids)
+
+    manifest.update(doc_id, {page_no: (new[page_no], counts[page_no], ends.get(page_no)) for page_no in changed},
+                    removed=removed)
+
+    stats["chunks"] = len(chunks)
+    stats["time"] = round(time.time() - started_at, 3)
+    stats["collection_name"] = vector_db.collection_name
+    stats["vector_dim"] = vector_db.vector_dim
+    return stats
@@ -1,18 +1,56 @@
 # vector_store.py
 
-from qdrant_client import QdrantClient, models
+import os
+import uuid
+import itertools
+import asyncio
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
 from tqdm import tqdm
 
+from src.retrieval.chunk_store import default_chunk_store
+
 def batch_iterate(lst, batch_size):
     for i in range(0, len(lst), batch_size):
         yield lst[i : i + batch_size]
 
+# One collection for every document, chunks are told apart by their doc_id payload
+DEFAULT_COLLECTION = os.getenv("QDRANT_COLLECTION", "documents")
+
+# payload field -> index type, so that metadata filters are evaluated inside the HNSW search
+PAYLOAD_INDEXES = {
+    "doc_id": models.PayloadSchemaType.KEYWORD,
+    "source": models.PayloadSchemaType.KEYWORD,
+    "course": models.PayloadSchemaType.KEYWORD,
+    "ingredients": models.PayloadSchemaType.KEYWORD,
+    "page_start": models.PayloadSchemaType.INTEGER,
+    "page_end": models.PayloadSchemaType.INTEGER,
+    "headings": models.TextIndexParams(
+        type=models.TextIndexType.TEXT,
+        tokenizer=models.TokenizerType.WORD,
+        lowercase=True,
+    ),
+}
+
+# what a search returns when the chunk text lives in the chunk store: ids and small metadata only
+SEARCH_PAYLOAD_FIELDS = ["doc_id", "source", "page_start", "page_end", "headings", "course", "ingredients"]
+
 class QdrantVDB:
-    def __init__(self, collection_name, vector_dim=768, batch_size=7):
+    def __init__(self, collection_name=DEFAULT_COLLECTION, vector_dim=768, batch_size=7, chunk_store=None):
         self.vector_dim = vector_dim
         self.batch_size = batch_size
-        self.client = QdrantClient(url="http://localhost:6333")
+        self.url = "http://localhost:6333"
+        self.client = QdrantClient(url=self.url)
+        self._async_client = None
         self.collection_name = collection_name
+        # when set, chunk text is kept out of the Qdrant payload (see ChunkStore)
+        self.chunk_store = chunk_store or default_chunk_store()
+
+    @property
+    def async_client(self):
+        # created on first use, so the sync-only Streamlit path never opens it
+        if self._async_client is None:
+            self._async_client = AsyncQdrantClient(url=self.url)
+        return self._async_client
 
     # def create_collection(self):
     # # Check if the collection exists
@@ -49,20 +87,162 @@ class QdrantVDB:
                     indexing_threshold=0
                 )
             )
+        # also on existing collections: ones created before the indexes existed get them here
+        self.create_payload_indexes()
+
+    def create_payload_indexes(self):
+        # indexed fields make the filters part of the vector search itself
+        existing = self.client.get_collection(self.collection_name).payload_schema or {}
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            if field_name in existing:
+                continue
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
+
+    def document_filter(self, doc_ids):
+        return models.Filter(must=[
+            models.FieldCondition(key="doc_id", match=models.MatchAny(any=list(doc_ids)))
+        ])
+
+    def build_filter(self, doc_ids=None, filters=None):
+        """
+        Qdrant filter for a document set plus metadata conditions, e.g.
+        {"course": "dolci", "ingredients": ["mele"], "page": (10, 20), "heading": "torta"}.
+        A models.Filter is passed through as is.
+        """
+        if isinstance(filters, models.Filter):
+            conditions = [filters]
+        else:
+            conditions = self.metadata_conditions(filters or {})
+        if doc_ids:
+            conditions.append(models.FieldCondition(key="doc_id", match=models.MatchAny(any=list(doc_ids))))
+        if not conditions:
+            return None
+        return models.Filter(must=conditions)
+
+    @staticmethod
+    def metadata_conditions(filters):
+        conditions = []
+        for key, value in filters.items():
+            if value is None or value == []:
+                continue
+            if key in ("course", "ingredients"):
+                values = [value] if isinstance(value, str) else list(value)
+                conditions.append(models.FieldCondition(key=key, match=models.MatchAny(any=values)))
+            elif key == "page":
+                # chunks whose page span overlaps [first, last]
+                first, last = (value, value) if isinstance(value, int) else value
+                conditions.append(models.FieldCondition(key="page_start", range=models.Range(lte=last)))
+                conditions.append(models.FieldCondition(key="page_end", range=models.Range(gte=first)))
+            elif key == "heading":
+                conditions.append(models.FieldCondition(key="headings", match=models.MatchText(text=value)))
+            else:
+                raise ValueError(f"unsupported filter: {key}")
+        return conditions
+
+    def count_document(self, doc_id):
+        return self.client.count(
+            collection_name=self.collection_name,
+            count_filter=self.document_filter([doc_id]),
+            exact=True,
+        ).count
+
+    def delete_document(self, doc_id):
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(filter=self.document_filter([doc_id])),
+        )
+        if self.chunk_store:
+            self.chunk_store.delete_document(doc_id)
+
+    # --------- Chunk text ---------
+    def payload_selector(self):
+        # with a chunk store the ~1024-token texts stay out of the search response
+        if self.chunk_store:
+            return models.PayloadSelectorInclude(include=SEARCH_PAYLOAD_FIELDS)
+        return True
+
+    def hydrate(self, points):
+        """Fills payload["context"] of points returned without it, in place."""
+        missing = [point for point in points if "context" not in point.payload]
+        if not missing:
+            return points
+        texts = self.chunk_store.get_many([point.id for point in missing]) if self.chunk_store else {}
+        # chunks ingested before the store was enabled still have their text in Qdrant
+        legacy = [point.id for point in missing if str(point.id) not in texts]
+        if legacy:
+            records = self.client.retrieve(collection_name=self.collection_name, ids=legacy,
+                                           with_payload=["context"])
+            texts.update({str(record.id): record.payload["context"] for record in records})
+        return self._fill(missing, texts, points)
 
+    async def ahydrate(self, points):
+        missing = [point for point in points if "context" not in point.payload]
+        if not missing:
+            return points
+        texts = (await asyncio.to_thread(self.chunk_store.get_many, [point.id for point in missing])
+                 if self.chunk_store else {})
+        legacy = [point.id for point in missing if str(point.id) not in texts]
+        if legacy:
+            records = await self.async_client.retrieve(collection_name=self.collection_name, ids=legacy,
+                                                       with_payload=["context"])
+            texts.update({str(record.id): record.payload["context"] for record in records})
+        return self._fill(missing, texts, points)
 
+    @staticmethod
+    def _fill(missing, texts, points):
+        for point in missing:
+            point.payload["context"] = texts.get(str(point.id), "")
+        return points
 
-    def ingest_data(self, embeddata):
-        for batch_context, batch_embeddings in tqdm(
+    def list_documents(self):
+        if not self.client.collection_exists(collection_name=self.collection_name):
+            return []
+        result = self.client.facet(collection_name=self.collection_name, key="doc_id", limit=1000)
+        return sorted(hit.value for hit in result.hits)
+
+    def delete_pages(self, doc_id, page_nos, chunk_ids=()):
+        # points of chunks starting on these pages (a chunk never spans pages in per-page mode)
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(filter=models.Filter(must=[
+                models.FieldCondition(key="doc_id", match=models.MatchValue(value=doc_id)),
+                models.FieldCondition(key="page_start", match=models.MatchAny(any=list(page_nos))),
+            ])),
+        )
+        if self.chunk_store:
+            self.chunk_store.delete_many(chunk_ids)
+
+    def ingest_data(self, embeddata, doc_id=None, source=None, ids=None):
+        # embeddings saved before chunk metadata existed have none
+        metadata = embeddata.metadata or [{}] * len(embeddata.contexts)
+        # without ids Qdrant assigns random ones, see incremental.chunk_id for stable ones
+        batch_ids_list = batch_iterate(ids, self.batch_size) if ids else itertools.repeat(None)
+        for batch_context, batch_embeddings, batch_metadata, batch_ids in tqdm(
             zip(batch_iterate(embeddata.contexts, self.batch_size),
-                batch_iterate(embeddata.embeddings, self.batch_size)),
+                batch_iterate(embeddata.embeddings, self.batch_size),
+                batch_iterate(metadata, self.batch_size),
+                batch_ids_list),
             total=len(embeddata.contexts) // self.batch_size,
             desc="Ingesting in batches"
         ):
+            payload = [{"doc_id": doc_id, "source": source, **chunk_metadata} for chunk_metadata in batch_metadata]
+            if self.chunk_store:
+                # text goes to the chunk store under the point id, Qdrant keeps vector + metadata
+                batch_ids = batch_ids or [str(uuid.uuid4()) for _ in batch_context]
+                self.chunk_store.put_many(batch_ids, batch_context, doc_id=doc_id)
+            else:
+                for chunk_payload, context in zip(payload, batch_context):
+                    chunk_payload["context"] = context
+
             self.client.upload_collection(
                 collection_name=self.collection_name,
                 vectors=batch_embeddings,
-                payload=[{"context": context} for context in batch_context]
+                payload=payload,
+                ids=batch_ids
             )
 
         self.client.update_collection(
@@ -0,0 +1,345 @@
+import os
+import glob
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from src.retrieval.artifacts import ArtifactStore
+from src.retrieval.incremental import ingest_document, PageManifest
+from src.retrieval.image_summary import get_image_summarizer, summarize_and_chunk, splice_summaries
+from src.retrieval.utils import prewarm_converter
+from src.retrieval.chunk_embed import chunk_pages, EmbedData, save_embeddings, load_embeddings
+from src.retrieval.index import QdrantVDB
+
+
+# stage -> progress (%) when the stage starts
+STAGES = {
+    "queued": 0,
+    "converting": 10,
+    "chunking": 40,
+    "embedding": 50,
+    "indexing": 80,
+    "done": 100,
+}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        content_hash TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL,
+        pdf_path TEXT NOT NULL,
+        status TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        progress INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        collection_name TEXT,
+        vector_dim INTEGER,
+        doc_id TEXT,
+        owner_pid INTEGER,
+        timings TEXT NOT NULL DEFAULT '{}',
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+"""
+
+
+# columns added after the first release of the table: name -> definition
+ADDED_COLUMNS = {
+    "doc_id": "TEXT",
+    "owner_pid": "INTEGER",
+}
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def create_schema(conn):
+    conn.execute(SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for column, definition in ADDED_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+
+def process_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_stale(row):
+    # queued or running for a process (app, API, CLI) that is gone: nobody will finish it
+    return row["status"] in ("queued", "running") and not process_alive(row["owner_pid"])
+
+
+def document_id(name, content_hash):
+    """
+    doc_id of an upload in the shared collection. It is the content hash, so two
+    different files with the same name never share chunks. With INCREMENTAL_INGEST
+    the file name is kept instead: a new upload with the same name is a new
+    version of that document and replaces its changed pages.
+    """
+    if os.getenv("INCREMENTAL_INGEST", "false").lower() == "true":
+        return name
+    return content_hash[:16]
+
+
+def embeddings_path(content_hash, summarizer=None, adaptive=False):
+    # cached embeddings depend on the content and on everything that changes the chunks
+    params = json.dumps({
+        "embed_model": "nomic-ai/nomic-embed-text-v1.5",
+        "token_limit": 1024,
+        "stride": 100,
+        # bumped when the chunk metadata changes (2: headings read from the markdown, not the decoded chunks)
+        "metadata": 2,
+        "adaptive": adaptive,
+        "image_summaries": summarizer.backend.name if summarizer else None,
+    }, sort_keys=True)
+    params_hash = hashlib.sha256(params.encode("utf-8")).hexdigest()[:8]
+    return f"embeddings_{content_hash[:16]}_{params_hash}.pkl"
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def update_job(db_path, job_id, **fields):
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    with connect(db_path) as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+# --------- Worker side ---------
+_embed_model = None
+
+
+def get_embed_model():
+    # loaded once per worker process and reused by the following jobs
+    global _embed_model
+    if _embed_model is None:
+        _embed_model = EmbedData().embed_model
+    return _embed_model
+
+
+def prewarm_worker():
+    # the embedding model and the Docling models stay loaded in the worker for the next jobs
+    get_embed_model()
+    prewarm_converter()
+
+
+def run_ingest_job(db_path, job_id, pdf_path, name, content_hash):
+    """
+    ArtifactStore.convert -> chunk_pages -> EmbedData.embed -> QdrantVDB.ingest_data,
+    run out of the Streamlit process. Progress and per-stage timings go to the job table.
+    """
+    timings = {}
+    current = {"stage": None, "started_at": time.time()}
+
+    def enter(stage):
+        now = time.time()
+        if current["stage"] is not None:
+            timings[current["stage"]] = round(now - current["started_at"], 3)
+        current["stage"], current["started_at"] = stage, now
+        update_job(db_path, job_id, stage=stage, progress=STAGES[stage], timings=json.dumps(timings))
+
+    try:
+        update_job(db_path, job_id, status="running")
+        doc_id = document_id(name, content_hash)
+        adaptive = os.getenv("CONVERT_ADAPTIVE", "false").lower() == "true"
+
+        if os.getenv("INCREMENTAL_INGEST", "false").lower() == "true":
+            # a new version of a document only reprocesses the pages that changed
+            stats = ingest_document(pdf_path, doc_id, get_embed_model(), PageManifest(db_path),
+                                    source=f"{name}.pdf", workers=int(os.getenv("CONVERT_WORKERS", 1)),
+                                    adaptive=adaptive, enter=enter)
+            # the points now follow the page manifest, embeddings cached by a full ingestion would not match them
+            for embeddings_file in glob.glob(f"embeddings_{content_hash[:16]}_*.pkl"):
+                os.remove(embeddings_file)
+            enter("done")
+            update_job(db_path, job_id, status="done", collection_name=stats["collection_name"],
+                       vector_dim=stats["vector_dim"], doc_id=doc_id)
+            return
+
+        summarizer = get_image_summarizer()
+        embeddings_file = embeddings_path(content_hash, summarizer, adaptive)
+
+        if os.path.isfile(embeddings_file):
+            # embeddings computed by a previous run, only the index may be missing
+            embeddata = load_embeddings(embeddings_file, embed_model=get_embed_model())
+        else:
+            enter("converting")
+            # a PDF already converted with the same pipeline options is not converted again
+            pages, images = ArtifactStore(os.getenv("ARTIFACTS_DIR", "artifacts")).convert(
+                pdf_path, workers=int(os.getenv("CONVERT_WORKERS", 1)),
+                adaptive=adaptive,
+                keep_images=summarizer is not None or os.getenv("CONVERT_KEEP_IMAGES", "false").lower() == "true",
+                with_images=True)
+
+            enter("chunking")
+            # chunks keep their pages, headings and course/ingredient tags as payload
+            if summarizer is not None and images:
+                # pictures are described while the text pages are tokenized
+                chunks, metadata = summarize_and_chunk(pages, images, summarizer)
+            else:
+                chunks, metadata = chunk_pages(splice_summaries(pages, [], []))
+
+            enter("embedding")
+            embeddata = EmbedData(batch_size=8, embed_model=get_embed_model())
+            embeddata.metadata = metadata
+            span = STAGES["indexing"] - STAGES["embedding"]
+            embeddata.embed(chunks, progress_callback=lambda done, total: update_job(
+                db_path, job_id, progress=STAGES["embedding"] + span * done // total))
+            save_embeddings(embeddata, embeddings_file)
+
+        enter("indexing")
+        # every document goes to the shared collection, tagged with its doc_id
+        vector_dim = len(embeddata.embeddings[0])
+        database = QdrantVDB(vector_dim=vector_dim, batch_size=7)
+        collection_name = database.collection_name
+        database.create_collection()
+        stored = database.chunk_store.count_document(doc_id) if database.chunk_store else len(embeddata.contexts)
+        if database.count_document(doc_id) != len(embeddata.contexts) or stored != len(embeddata.contexts):
+            # missing or partially ingested: replace its chunks
+            database.delete_document(doc_id)
+            # the new points have random ids, a page manifest of this document no longer describes them
+            PageManifest(db_path).clear(doc_id)
+            database.ingest_data(embeddata, doc_id=doc_id, source=f"{name}.pdf")
+
+        enter("done")
+        update_job(db_path, job_id, status="done", collection_name=collection_name, vector_dim=vector_dim,
+                   doc_id=doc_id)
+    except Exception as e:
+        update_job(db_path, job_id, status="failed", error=f"{type(e).__name__}: {e}")
+        raise
+
+
+# --------- Queue ---------
+class JobQueue:
+    # uploads are kept under static/ so that the app can serve them for the PDF preview
+    def __init__(self, db_path="jobs.db", upload_dir="static/uploads", max_workers=1, resume=True, prewarm=False):
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        os.makedirs(upload_dir, exist_ok=True)
+        with connect(db_path) as conn:
+            create_schema(conn)
+
+        # spawn: the workers must not inherit Streamlit's threads or loaded torch state
+        self.pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        if prewarm:
+            # one task per worker starts the processes and loads their models before the first upload
+            for _ in range(max_workers):
+                self.pool.submit(prewarm_worker)
+        if resume:
+            self._resume()
+
+    def _resume(self):
+        # jobs left unfinished by a process that is gone are started again,
+        # the ones another live process (app, API, CLI) is running are left to it
+        with connect(self.db_path) as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        for row in rows:
+            if not is_stale(row):
+                continue
+            if os.path.isfile(row["pdf_path"]):
+                self._start(row["id"], row["pdf_path"], row["name"], row["content_hash"])
+            else:
+                update_job(self.db_path, row["id"], status="failed", error="uploaded file is missing")
+
+    def _start(self, job_id, pdf_path, name, content_hash):
+        update_job(self.db_path, job_id, status="queued", stage="queued", progress=0, error=None,
+                   owner_pid=os.getpid())
+        self.pool.submit(run_ingest_job, self.db_path, job_id, pdf_path, name, content_hash)
+
+    def _superseded(self, row):
+        """
+        With INCREMENTAL_INGEST the doc_id is the file name, so the collection holds
+        the last version ingested under that name. A done job whose content was
+        replaced since (v1, v2, then v1 again) has to run again; unchanged pages are skipped.
+        """
+        if row["status"] != "done" or os.getenv("INCREMENTAL_INGEST", "false").lower() != "true":
+            return False
+        with connect(self.db_path) as conn:
+            latest = conn.execute("SELECT id FROM jobs WHERE name = ? AND status != 'failed' "
+                                  "ORDER BY updated_at DESC LIMIT 1", (row["name"],)).fetchone()
+        return latest["id"] != row["id"]
+
+    def submit(self, data, filename):
+        """
+        Queues the ingestion of an uploaded PDF and returns the job id.
+        The same content submitted twice maps to the same job.
+        """
+        content_hash = file_hash(data)
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE content_hash = ?", (content_hash,)).fetchone()
+
+        if row is not None:
+            if row["status"] == "failed" or is_stale(row) or self._superseded(row):
+                if not os.path.isfile(row["pdf_path"]):
+                    with open(row["pdf_path"], "wb") as f:
+                        f.write(data)
+                self._start(row["id"], row["pdf_path"], row["name"], content_hash)
+            return row["id"]
+
+        name = filename.rsplit('.', 1)[0]
+        pdf_path = os.path.join(self.upload_dir, f"{content_hash}.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(data)
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            with connect(self.db_path) as conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, content_hash, name, pdf_path, status, stage, owner_pid, created_at, "
+                    "updated_at) VALUES (?, ?, ?, ?, 'queued', 'queued', ?, ?, ?)",
+                    (job_id, content_hash, name, pdf_path, os.getpid(), now, now),
+                )
+        except sqlite3.IntegrityError:
+            # submitted at the same time by another process sharing the job table
+            with connect(self.db_path) as conn:
+                return conn.execute("SELECT id FROM jobs WHERE content_hash = ?", (content_hash,)).fetchone()["id"]
+        self.pool.submit(run_ingest_job, self.db_path, job_id, pdf_path, name, content_hash)
+        return job_id
+
+    def get(self, job_id):
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["timings"] = json.loads(job["timings"])
+        return job
+
+    def list(self):
+        with connect(self.db_path) as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC").fetchall()
+        return [dict(row, timings=json.loads(row["timings"])) for row in rows]
+
+
+def document_names(db_path="jobs.db"):
+    """doc_id -> file name of every ingested document, for display."""
+    with connect(db_path) as conn:
+        create_schema(conn)
+        rows = conn.execute("SELECT doc_id, name FROM jobs WHERE status = 'done' AND doc_id IS NOT NULL "
+                            "ORDER BY created_at").fetchall()
+    return {row["doc_id"]: row["name"] for row in rows}
+
+
+def doc_ids_for(name, db_path="jobs.db"):
+    # every ingested version of a file name, newest last
+    return [doc_id for doc_id, doc_name in document_names(db_path).items() if doc_name == name]
@@ -0,0 +1,325 @@
+import time
+import random
+import asyncio
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import openai
+
+
+# Errors worth another attempt: network problems, timeouts, throttling and 5xx
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMUnavailableError(Exception):
+    pass
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "half-open":
+                # let a single trial request through, the others keep failing fast
+                self.opened_at = time.monotonic()
+                return True
+            return state == "closed"
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class PrefetchedStream:
+    """
+    A completion stream whose first chunk has already been read.
+    Reading it is what the hedging delay is measured on.
+    """
+    def __init__(self, stream, iterator, first_chunk):
+        self.stream = stream
+        self.iterator = iterator
+        self.first_chunk = first_chunk
+        # end of the whole call, set by create_stream
+        self.deadline_at = None
+
+    def __iter__(self):
+        if self.first_chunk is not None:
+            yield self.first_chunk
+        yield from self.iterator
+
+    async def __aiter__(self):
+        if self.first_chunk is not None:
+            yield self.first_chunk
+        async for chunk in self.iterator:
+            yield chunk
+
+    def close(self):
+        return self.stream.close()
+
+
+class ResilientLLM:
+    def __init__(self, client, async_client=None, timeout=30.0, deadline=60.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, hedge=False, hedge_quantile=0.95,
+                 hedge_min_samples=20, breaker=None):
+        self.client = client
+        self.async_client = async_client
+        self.timeout = timeout            # per attempt, also the max gap between streamed chunks
+        self.deadline = deadline          # for the whole call, retries included
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+
+        self.metrics = Counter()
+        self.latencies = deque(maxlen=500)   # seconds to first chunk of successful attempts
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+    # --------- Policy ---------
+    def hedge_delay(self):
+        if not self.hedge or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * self.hedge_quantile), len(ordered) - 1)]
+
+    def backoff(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def record_error(self, error):
+        if isinstance(error, openai.APITimeoutError):
+            self.metrics["timeout"] += 1
+        elif isinstance(error, openai.RateLimitError):
+            self.metrics["rate_limited"] += 1
+        else:
+            self.metrics["error"] += 1
+
+    # --------- Sync ---------
+    def create_stream(self, **kwargs):
+        """
+        Opens a streaming chat completion with retries, optional hedging and
+        the circuit breaker. Raises LLMUnavailableError when no answer can be had.
+        The returned stream carries the deadline, see stream_expired.
+        """
+        deadline_at = time.monotonic() + self.deadline
+        stream = self._call(lambda timeout: self._hedged(lambda: self._open(kwargs, timeout)), deadline_at)
+        stream.deadline_at = deadline_at
+        return stream
+
+    def create(self, **kwargs):
+        # non streaming completion (history summaries, image captions): same retries, deadline and breaker
+        return self._call(lambda timeout: self.client.chat.completions.create(**kwargs, timeout=timeout),
+                          time.monotonic() + self.deadline)
+
+    def stream_expired(self, stream):
+        """
+        The deadline covers the whole answer, not only the first chunk: checked by
+        the consumers between chunks, which then close the stream.
+        """
+        deadline_at = getattr(stream, "deadline_at", None)
+        if deadline_at is None or time.monotonic() < deadline_at:
+            return False
+        self.metrics["stream_deadline_exceeded"] += 1
+        print(f"LLM answer exceeded the {self.deadline:.0f}s deadline, closing the stream")
+        return True
+
+    def _call(self, call, deadline_at):
+        if not self.breaker.allow():
+            self.metrics["circuit_open"] += 1
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.metrics["retry"] += 1
+                time.sleep(min(self.backoff(attempt - 1), max(deadline_at - time.monotonic(), 0)))
+
+            timeout = min(self.timeout, deadline_at - time.monotonic())
+            if timeout <= 0:
+                self.metrics["deadline_exceeded"] += 1
+                break
+            try:
+                result = call(timeout)
+            except RETRYABLE_ERRORS as e:
+                self.record_error(e)
+                last_error = e
+                continue
+            except openai.APIError:
+                # 4xx: retrying will not help, and it says nothing about upstream health
+                self.metrics["error"] += 1
+                raise
+
+            self.breaker.record_success()
+            self.metrics["success"] += 1
+            return result
+
+        self.breaker.record_failure()
+        raise LLMUnavailableError(f"LLM request failed after {attempt + 1} attempts") from last_error
+
+    def _open(self, kwargs, timeout):
+        started_at = time.monotonic()
+        stream = self.client.chat.completions.create(**kwargs, timeout=timeout)
+        iterator = iter(stream)
+        try:
+            first_chunk = next(iterator, None)
+        except BaseException:
+            stream.close()
+            raise
+        self.latencies.append(time.monotonic() - started_at)
+        return PrefetchedStream(stream, iterator, first_chunk)
+
+    def _hedged(self, call):
+        delay = self.hedge_delay()
+        if delay is None:
+            return call()
+
+        primary = self._executor.submit(call)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # primary is slower than the p95: race a second identical request against it
+        self.metrics["hedge_launched"] += 1
+        hedge = self._executor.submit(call)
+        pending = [primary, hedge]
+        error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is hedge:
+                    self.metrics["hedge_won"] += 1
+                for loser in pending:
+                    loser.add_done_callback(self._close_loser)
+                return future.result()
+        raise error
+
+    @staticmethod
+    def _close_loser(future):
+        if future.exception() is None:
+            future.result().close()
+
+    # --------- Async ---------
+    async def acreate_stream(self, **kwargs):
+        deadline_at = time.monotonic() + self.deadline
+        stream = await self._acall(lambda timeout: self._ahedged(lambda: self._aopen(kwargs, timeout)), deadline_at)
+        stream.deadline_at = deadline_at
+        return stream
+
+    async def _acall(self, call, deadline_at):
+        if not self.breaker.allow():
+            self.metrics["circuit_open"] += 1
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.metrics["retry"] += 1
+                await asyncio.sleep(min(self.backoff(attempt - 1), max(deadline_at - time.monotonic(), 0)))
+
+            timeout = min(self.timeout, deadline_at - time.monotonic())
+            if timeout <= 0:
+                self.metrics["deadline_exceeded"] += 1
+                break
+            try:
+                result = await call(timeout)
+            except RETRYABLE_ERRORS as e:
+                self.record_error(e)
+                last_error = e
+                continue
+            except openai.APIError:
+                self.metrics["error"] += 1
+                raise
+
+            self.breaker.record_success()
+            self.metrics["success"] += 1
+            return result
+
+        self.breaker.record_failure()
+        raise LLMUnavailableError(f"LLM request failed after {attempt + 1} attempts") from last_error
+
+    async def _aopen(self, kwargs, timeout):
+        started_at = time.monotonic()
+        stream = await self.async_client.chat.completions.create(**kwargs, timeout=timeout)
+        iterator = stream.__aiter__()
+        try:
+            first_chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            first_chunk = None
+        except BaseException:
+            # also when cancelled as a hedging loser: the response is already open
+            await stream.close()
+            raise
+        self.latencies.append(time.monotonic() - started_at)
+        return PrefetchedStream(stream, iterator, first_chunk)
+
+    async def _ahedged(self, call):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await call()
+
+        primary = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self.metrics["hedge_launched"] += 1
+        hedge = asyncio.ensure_future(call())
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in done if task.exception() is None]
+            if not winners:
+                error = next(iter(done)).exception()
+                continue
+
+            winner = hedge if hedge in winners else winners[0]
+            if winner is hedge:
+                self.metrics["hedge_won"] += 1
+            for loser in pending:
+                loser.cancel()
+            for other in winners:
+                if other is not winner:
+                    await other.result().close()
+            return winner.result()
+        raise error
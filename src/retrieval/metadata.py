@@ -0,0 +1,55 @@
+import re
+
+
+# Course -> word stems (regex fragments) that point to it, matched at the start of a word
+COURSE_KEYWORDS = {
+    "antipasti": ["antipast", "stuzzichin", "bruschett", "crostin", "tartin", "finger food"],
+    "primi": ["primo piatto", "primi piatti", "pasta", "spaghett", "risott", "lasagn", "gnocch",
+              "tagliatell", "ravioli", "tortell", "minestr", "zupp", "vellutat"],
+    "secondi": ["secondo piatto", "secondi piatti", "arrost", "brasat", "scaloppin", "cotolett",
+                "polpett", "filetto", "spezzatin", "ossobuc"],
+    "contorni": ["contorn", "insalat", "verdure grigliate", "purè"],
+    "dolci": ["dolc", "dessert", r"tort[ae]\b", "crostat", "biscott", "tiramis", "panna cotta", "gelat",
+              "semifredd", "pasticcin", "budin", "panettone"],
+}
+
+INGREDIENTS = [
+    "aglio", "acciughe", "asparagi", "basilico", "burro", "cacao", "carciofi", "carne", "carote",
+    "castagne", "cioccolato", "cipolla", "cipolle", "fagioli", "farina", "finocchi", "formaggio",
+    "funghi", "gamberi", "limone", "latte", "lenticchie", "mandorle", "mascarpone", "mele",
+    "melanzane", "merluzzo", "miele", "mozzarella", "nocciole", "noci", "olio", "olive", "orzo",
+    "panna", "parmigiano", "patate", "peperoni", "pesce", "piselli", "pistacchi", "pollo",
+    "pomodori", "pomodoro", "porri", "prezzemolo", "prosciutto", "radicchio", "ricotta", "riso",
+    "rosmarino", "salmone", "salsiccia", "speck", "spinaci", "tonno", "uova", "uovo", "vitello",
+    "vongole", "zafferano", "zucca", "zucchero", "zucchine",
+]
+
+HEADING_PATTERN = re.compile(r'^#{1,6}\s+(.+?)\s*#*\s*$', re.M)
+
+_course_patterns = {
+    course: re.compile(r'\b(?:' + "|".join(stems) + r')', re.I)
+    for course, stems in COURSE_KEYWORDS.items()
+}
+_ingredient_pattern = re.compile(r'\b(' + "|".join(re.escape(name) for name in INGREDIENTS) + r')\b', re.I)
+
+
+def extract_headings(text):
+    return [heading.strip() for heading in HEADING_PATTERN.findall(text)]
+
+
+def heading_spans(text):
+    # (character offset, heading) of every markdown heading of the text
+    return [(match.start(), match.group(1).strip()) for match in HEADING_PATTERN.finditer(text)]
+
+
+def detect_courses(text, headings=()):
+    # headings are the strongest signal ("Dolci", "Primi piatti"), fall back to the body
+    for source in (" ".join(headings), text):
+        courses = [course for course, pattern in _course_patterns.items() if pattern.search(source)]
+        if courses:
+            return courses
+    return []
+
+
+def detect_ingredients(text):
+    return sorted({match.lower() for match in _ingredient_pattern.findall(text)})
@@ -0,0 +1,128 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdfium2
+
+from src.retrieval.utils import (get_converter, prewarm_converter, default_pipeline_options,
+                                 adaptive_pipeline_options, export_pages)
+
+
+# workers -> pool whose processes keep their converters warm between tasks
+_pools = {}
+
+
+def page_count(pdf_path):
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def page_ranges(n_pages, pages_per_task):
+    # docling page ranges are 1-based and inclusive
+    return [(start, min(start + pages_per_task - 1, n_pages))
+            for start in range(1, n_pages + 1, pages_per_task)]
+
+
+def convert_page_range(pdf_path, first, last, pipeline_options):
+    """Runs in a pool worker: converts pages first..last with the worker's warm converter."""
+    result = get_converter(pipeline_options).convert(pdf_path, page_range=(first, last))
+    document = result.document
+    # page numbers are those of the whole PDF, so the ranges can be merged as they are
+    return document, export_pages(document)
+
+
+def get_pool(workers, pipeline_options=None):
+    # workers load the converter for pipeline_options at start, others on their first task
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers,
+                                              mp_context=multiprocessing.get_context("spawn"),
+                                              initializer=prewarm_converter,
+                                              initargs=(pipeline_options,))
+    return _pools[workers]
+
+
+def shutdown_pool(workers, wait=True):
+    # a later get_pool with the same number of workers starts a new pool
+    pool = _pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+def convert_ranges(pdf_path, tasks, workers=1):
+    """
+    Converts [(first, last, pipeline_options), ...] page ranges, in this process
+    or in the pool, and merges them back in page order.
+    """
+    if workers > 1:
+        pool = get_pool(workers, tasks[0][2])
+        futures = [pool.submit(convert_page_range, pdf_path, first, last, options) for first, last, options in tasks]
+        results = [future.result() for future in futures]
+    else:
+        results = [convert_page_range(pdf_path, first, last, options) for first, last, options in tasks]
+
+    documents, pages = [], []
+    for document, range_pages in results:
+        documents.append(document)
+        pages.extend(range_pages)
+    pages.sort(key=lambda page: page[0])
+    return documents, pages
+
+
+def convert_pdf_parallel(pdf_path, pipeline_options=None, workers=None, pages_per_task=8):
+    """
+    Splits the PDF in page ranges converted side by side by a process pool.
+    Returns the DoclingDocument of every range and [(page_no, markdown), ...] in page order.
+
+    Markdown is exported page by page in both modes, so the stitched output
+    is the same as export_pages on a sequential conversion: headings are
+    rendered from their own page and tables are already split at page breaks.
+    """
+    pipeline_options = pipeline_options or default_pipeline_options()
+    workers = workers or int(os.getenv("CONVERT_WORKERS", os.cpu_count() or 1))
+    tasks = [(first, last, pipeline_options) for first, last in page_ranges(page_count(pdf_path), pages_per_task)]
+    return convert_ranges(pdf_path, tasks, workers=workers)
+
+
+def text_layer_pages(pdf_path, min_chars=100):
+    """Pages (1-based) with a usable text layer, i.e. born-digital pages that need no OCR."""
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        pages = set()
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+            if sum(char.isalnum() for char in text) >= min_chars:
+                pages.add(i + 1)
+        return pages
+    finally:
+        pdf.close()
+
+
+def convert_pdf_adaptive(pdf_path, keep_images=False, workers=1, pages_per_task=8, min_chars=100):
+    """
+    Converts runs of born-digital pages without OCR and scanned pages with it,
+    skipping image rendering unless keep_images. Same return value as convert_pdf_parallel.
+    """
+    n_pages = page_count(pdf_path)
+    digital = text_layer_pages(pdf_path, min_chars=min_chars)
+    print(f"{len(digital)}/{n_pages} pages have a text layer, OCR runs on the others")
+
+    with_ocr = adaptive_pipeline_options(do_ocr=True, keep_images=keep_images)
+    without_ocr = adaptive_pipeline_options(do_ocr=False, keep_images=keep_images)
+
+    # consecutive pages of the same kind form a range, cut at pages_per_task for the pool
+    tasks = []
+    for page_no in range(1, n_pages + 1):
+        options = without_ocr if page_no in digital else with_ocr
+        if tasks and tasks[-1][2] is options and tasks[-1][1] == page_no - 1 \
+                and page_no - tasks[-1][0] < pages_per_task:
+            tasks[-1] = (tasks[-1][0], page_no, options)
+        else:
+            tasks.append((page_no, page_no, options))
+    return convert_ranges(pdf_path, tasks, workers=workers)
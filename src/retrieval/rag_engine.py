@@ -1,32 +1,78 @@
 import os
+import time
+import asyncio
+import hashlib
+import threading
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from src.retrieval.context import ContextBuilder, normalize
+from src.retrieval.coalesce import inflight_queries
+from src.retrieval.history import ConversationHistory
+from src.retrieval.llm_client import ResilientLLM, LLMUnavailableError
 
 
 load_dotenv(override=True)
 
+
+def create_llm_client():
+    # retries are handled by ResilientLLM, not by the OpenAI clients
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"), max_retries=0)
+    async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"),
+                               max_retries=0)
+
+    # timeouts, retries, hedging and circuit breaker around the completion calls
+    return ResilientLLM(client, async_client,
+                        timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+                        deadline=float(os.getenv("LLM_DEADLINE", 60)),
+                        max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+                        hedge=os.getenv("LLM_HEDGE", "false").lower() == "true")
+
+
 class RAG:
-    def __init__(self, retriever): 
+    def __init__(self, retriever, summarize_history=False, speculative=False, coalesce=True, llm_client=None,
+                 doc_ids=None, filters=None): 
 
-        self.llm = self._setup_llm()
+        # the client (connection pools, breaker, latency stats) can be shared between sessions
+        self.llm_client = llm_client or create_llm_client()
+        self.llm = self.llm_client.client
+        self.async_llm = self.llm_client.async_client
         self.llm_name = os.getenv("OPENAI_DEPLOYMENT_NAME")
         self.retriever = retriever
-
-        self.conversation_history = []
+        # documents of the shared collection this session searches, None for all of them
+        self.doc_ids = doc_ids
+        # metadata conditions (course, ingredients, page, heading), see QdrantVDB.build_filter
+        self.filters = filters
+        # warm the LLM connection while retrieval is still running
+        self.speculative = speculative
+        self.warm_up_timeout = 2.0
+        # share retrieval and the upstream stream between identical concurrent queries
+        self.coalesce = coalesce
+        self.inflight = inflight_queries
+        self.context_builder = ContextBuilder(model_name=self.llm_name,
+                                              token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000)))
+
+        # token-bounded window sent with every request, older turns are summarized or dropped
+        self.history = ConversationHistory(count_tokens=self.context_builder.count_tokens,
+                                           encoding=self.context_builder.encoding,
+                                           max_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", 1500)),
+                                           summarizer=self.summarize_history if summarize_history else None)
+        self.last_context_stats = None
 
         self.last_question = None
 
-        self.qa_prompt_tmpl_str = """
-            Le informazioni di contesto sono riportate di seguito.
-            <context/user_query>:
-            ---------------------
-            {context}
-            ---------------------
+        self.last_prompt_stats = None
+        self.last_stream_stats = None
+        self.prompt_cache_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+        # Static instructions first and identical on every request, so the provider
+        # can serve them from its prompt cache. Variable content goes in qa_prompt_tmpl_str.
+        self.system_prompt_str = """
+            Sei un assistente di cucina. Riceverai delle informazioni di contesto estratte da un ricettario e una richiesta dell’utente.
 
-            Sulla base delle informazioni contenute in `{context}`, genera una **ricetta completa e chiara** che risponda alla richiesta dell’utente. Segui queste regole in modo preciso:
+            Sulla base delle informazioni di contesto, genera una **ricetta completa e chiara** che risponda alla richiesta dell’utente. Segui queste regole in modo preciso:
 
             1. **Fonte delle informazioni:**  
-            - Usa **solo** le informazioni presenti in `{context}`.  
+            - Usa **solo** le informazioni presenti nel contesto.  
             - Non inventare ingredienti o passaggi di preparazione non presenti nel contesto.
 
             2. **Obiettivo della ricetta:**  
@@ -72,42 +118,248 @@ class RAG:
 
             9. **Lingua:**  
             - Solo Italiano.
+        """
 
+        self.qa_prompt_tmpl_str = """
+            Le informazioni di contesto sono riportate di seguito.
+            ---------------------
+            {context}
             ---------------------
             Richiesta utente: {query}
             ---------------------
             Risposta:
-
         """
 
-    def _setup_llm(self):
-        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def warm_up(self):
+        """
+        Opens (or refreshes) a pooled connection to the LLM endpoint, so the
+        completion request that follows retrieval skips DNS, TCP and TLS setup.
+        """
+        try:
+            self.llm.with_options(max_retries=0, timeout=self.warm_up_timeout).models.list()
+        except Exception as e:
+            # any HTTP answer (even 404 on deployments without /models) leaves the connection pooled
+            print(f"LLM warm-up request failed: {e}")
+
+    async def awarm_up(self):
+        try:
+            await self.async_llm.with_options(max_retries=0, timeout=self.warm_up_timeout).models.list()
+        except Exception as e:
+            print(f"LLM warm-up request failed: {e}")
 
     def generate_context(self, query):
-        result = self.retriever.search(query)
-        context = [dict(data) for data in result]
-        combined_prompt = []
+        result = self.retriever.search(query, doc_ids=self.doc_ids, filters=self.filters)
+        return self.assemble_context(result)
+
+    async def agenerate_context(self, query):
+        result = await self.retriever.asearch(query, doc_ids=self.doc_ids, filters=self.filters)
+        return self.assemble_context(result)
+
+    def assemble_context(self, result):
+        context, stats = self.context_builder.build(result)
 
-        for entry in context:
-            context_str = entry["payload"]["context"]
-            combined_prompt.append(context_str)
+        # token counts of the last request, for monitoring
+        self.last_context_stats = stats
+        print(f"Context tokens: {stats['context_tokens']}/{stats['token_budget']} "
+              f"({stats['chunks_used']}/{stats['candidate_chunks']} chunks, "
+              f"{stats['candidate_tokens']} tokens retrieved)")
 
-        return "\n\n---\n\n".join(combined_prompt)
+        return context
     
-    def stream_and_store(self, stream):
-        full_text = ""
-        for chunk in stream:
-            delta = chunk.choices[0].delta
-            if delta.content:
-                full_text += delta.content
-                yield delta.content   # for real streaming
+    def summarize_history(self, summary, dropped):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in dropped)
+        if summary:
+            transcript = f"Riassunto precedente: {summary}\n{transcript}"
+
+        # same retries, deadline and circuit breaker as the answers
+        try:
+            response = self.llm_client.create(
+                model=self.llm_name,
+                messages=[
+                    {"role": "system", "content": "Riassumi in italiano, in al massimo 3 frasi, "
+                                                  "le richieste dell’utente e le ricette già proposte."},
+                    {"role": "user", "content": transcript}
+                ],
+            )
+        except LLMUnavailableError as e:
+            # the dropped turns are lost, the previous summary is kept
+            print(f"History summary skipped, LLM unavailable: {e}")
+            return summary
+        return response.choices[0].message.content
+
+    def build_messages(self, query, context, difficulty=None, history=None):
+        prompt = self.qa_prompt_tmpl_str.format(context=context, difficulty=difficulty, query=query)
+        history = self.history.messages() if history is None else history
+
+        messages = [
+            {"role": "system", "content": self.system_prompt_str},
+            *history,
+            {"role": "user", "content": prompt}
+        ]
+
+        # token accounting per section: the system prefix is the cacheable part
+        count_tokens = self.context_builder.count_tokens
+        self.last_prompt_stats = {
+            "system_tokens": count_tokens(self.system_prompt_str),
+            "context_tokens": count_tokens(context),
+            "query_tokens": count_tokens(query),
+            "user_tokens": count_tokens(prompt),
+            "history_tokens": sum(count_tokens(message["content"]) for message in history),
+        }
+
+        return messages
+
+    def record_usage(self, usage):
+        prompt_tokens = usage.prompt_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+        if self.last_prompt_stats is not None:
+            self.last_prompt_stats["prompt_tokens"] = prompt_tokens
+            self.last_prompt_stats["cached_tokens"] = cached_tokens
 
-        self.conversation_history.append({
-            "role": "assistant",
-            "content": full_text
-        })
+        self.prompt_cache_stats["requests"] += 1
+        self.prompt_cache_stats["prompt_tokens"] += prompt_tokens
+        self.prompt_cache_stats["cached_tokens"] += cached_tokens
 
+        hit_rate = self.prompt_cache_stats["cached_tokens"] / max(self.prompt_cache_stats["prompt_tokens"], 1)
+        print(f"Prompt tokens: {prompt_tokens} ({cached_tokens} cached), "
+              f"cached-prefix hit rate so far: {hit_rate:.1%}")
 
+    def stream_and_store(self, stream, started_at=None, query_started_at=None):
+        """
+        Yields the streamed deltas while accumulating them in a list.
+        The reply is stored in the history even if the consumer stops early.
+        """
+        started_at = started_at or time.perf_counter()
+        first_token_at = None
+        completion_tokens = None
+        pieces = []
+        completed = False
+
+        try:
+            for chunk in stream:
+                if self.llm_client.stream_expired(stream):
+                    break
+                if chunk.usage:
+                    completion_tokens = chunk.usage.completion_tokens
+                    self.record_usage(chunk.usage)
+                if not chunk.choices:
+                    # the final chunk requested with include_usage carries no choices
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    pieces.append(delta.content)
+                    yield delta.content   # for real streaming
+            else:
+                completed = True
+        finally:
+            if not completed and hasattr(stream, "close"):
+                # consumer went away: release the upstream connection
+                stream.close()
+
+            self.store_reply(pieces, started_at, first_token_at, completion_tokens, completed, query_started_at)
+
+    async def astream_and_store(self, stream, started_at=None, query_started_at=None):
+        started_at = started_at or time.perf_counter()
+        first_token_at = None
+        completion_tokens = None
+        pieces = []
+        completed = False
+
+        try:
+            async for chunk in stream:
+                if self.llm_client.stream_expired(stream):
+                    break
+                if chunk.usage:
+                    completion_tokens = chunk.usage.completion_tokens
+                    self.record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    pieces.append(delta.content)
+                    yield delta.content
+            else:
+                completed = True
+        finally:
+            if not completed and hasattr(stream, "close"):
+                await stream.close()
+
+            # history summarization may call the LLM synchronously, keep it off the event loop
+            await asyncio.to_thread(self.store_reply, pieces, started_at, first_token_at,
+                                    completion_tokens, completed, query_started_at)
+
+    def store_reply(self, pieces, started_at, first_token_at, completion_tokens, completed, query_started_at=None):
+        full_text = "".join(pieces)
+        if full_text:
+            self.history.add("assistant", full_text)
+        self.record_stream_stats(started_at, first_token_at, completion_tokens or len(pieces), completed,
+                                 query_started_at)
+
+    def record_stream_stats(self, started_at, first_token_at, tokens, completed, query_started_at=None):
+        finished_at = time.perf_counter()
+        generation_time = finished_at - first_token_at if first_token_at else 0.0
+        query_started_at = query_started_at or started_at
+
+        self.last_stream_stats = {
+            "ttft": first_token_at - started_at if first_token_at else None,
+            # from the user's question, retrieval included
+            "end_to_end_ttft": first_token_at - query_started_at if first_token_at else None,
+            "speculative": self.speculative,
+            "total_time": finished_at - started_at,
+            "completion_tokens": tokens,
+            "tokens_per_second": tokens / generation_time if generation_time > 0 else None,
+            "completed": completed,
+        }
+
+        ttft = self.last_stream_stats["ttft"]
+        tps = self.last_stream_stats["tokens_per_second"]
+        e2e_ttft = self.last_stream_stats["end_to_end_ttft"]
+        print(f"Time to first token: {f'{ttft:.3f}s' if ttft is not None else 'n/a'} "
+              f"({f'{e2e_ttft:.3f}s' if e2e_ttft is not None else 'n/a'} end to end), "
+              f"{tokens} tokens at {f'{tps:.1f}' if tps else 'n/a'} tokens/s"
+              f"{'' if completed else ' (stopped early)'}")
+
+    def degraded_answer(self, context):
+        self.llm_client.metrics["degraded"] += 1
+        return ("Il servizio di generazione non è al momento disponibile. "
+                "Ecco le informazioni trovate nel ricettario:\n\n" + context)
+
+    def open_stream(self, query, difficulty, history=None):
+        """
+        Retrieval, prompt building and the completion request.
+        Returns the response stream (None if the LLM is unavailable), the context and the request start.
+        """
+        warm_up = None
+        if self.speculative:
+            warm_up = threading.Thread(target=self.warm_up, daemon=True)
+            warm_up.start()
+
+        context = self.generate_context(query)
+        messages = self.build_messages(query, context, difficulty=difficulty, history=history)
+
+        if warm_up is not None:
+            # normally finished long before retrieval, never wait more than the handshake budget
+            warm_up.join(timeout=self.warm_up_timeout)
+
+        started_at = time.perf_counter()
+        try:
+            response = self.llm_client.create_stream(
+                model=self.llm_name,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        except LLMUnavailableError as e:
+            print(f"LLM unavailable, answering with the retrieved context only: {e}")
+            response = None
+
+        return response, context, started_at
 
     def query(self, query, difficulty):
         """
@@ -116,18 +368,120 @@ class RAG:
         - If there is an active question → evaluate or continue the discussion.
         """
 
-        context = self.generate_context(query)
-        prompt = self.qa_prompt_tmpl_str.format(context=context, difficulty=difficulty, query=query)
+        query_started_at = time.perf_counter()
 
-        messages = [
-            {"role": "system", "content": "You are a university examiner."},
-            {"role": "user", "content": prompt}
-        ]
+        if self.coalesce:
+            return self.coalesced_query(query, difficulty, query_started_at)
+
+        response, context, started_at = self.open_stream(query, difficulty)
+        self.history.add("user", query)
 
-        response = self.llm.chat.completions.create(
-            model=self.llm_name,
-            messages=messages,
-            stream=True,
-        )
+        if response is None:
+            return iter([self.degraded_answer(context)])
         
-        return self.stream_and_store(response)
+        return self.stream_and_store(response, started_at=started_at, query_started_at=query_started_at)
+
+    def coalesced_query(self, query, difficulty, query_started_at):
+        """
+        Single-flight: concurrent identical questions (same collection, documents and filters,
+        normalized query, difficulty and conversation so far) share one retrieval and one
+        upstream stream, whose tokens are fanned out to every waiting consumer.
+        """
+        history = self.history.messages()
+        history_digest = hashlib.sha1(repr(history).encode("utf-8")).hexdigest()
+        doc_ids = tuple(sorted(self.doc_ids)) if self.doc_ids else None
+        filters = repr(sorted(self.filters.items())) if isinstance(self.filters, dict) else repr(self.filters)
+        key = (self.retriever.vector_db.collection_name, doc_ids, filters, normalize(query), difficulty,
+               history_digest)
+
+        flight, leader = self.inflight.join(key)
+        if leader:
+            # produced outside the consumer, so an impatient leader does not cut off the others
+            threading.Thread(target=self.produce, args=(key, flight, query, difficulty, history),
+                             daemon=True).start()
+        else:
+            print("Identical query already in flight, sharing its answer")
+
+        self.history.add("user", query)
+        return self.relay_and_store(key, flight, query_started_at, coalesced=not leader)
+
+    def produce(self, key, flight, query, difficulty, history):
+        error = None
+        try:
+            response, context, started_at = self.open_stream(query, difficulty, history=history)
+            flight.started_at = started_at
+            if response is None:
+                flight.publish(self.degraded_answer(context))
+                return
+
+            try:
+                for chunk in response:
+                    if flight.cancelled:
+                        break
+                    if self.llm_client.stream_expired(response):
+                        flight.expired = True
+                        break
+                    if chunk.usage:
+                        self.record_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        flight.publish(chunk.choices[0].delta.content)
+            finally:
+                response.close()
+        except Exception as e:
+            error = e
+        finally:
+            self.inflight.forget(key, flight)
+            flight.finish(error)
+
+    def relay_and_store(self, key, flight, query_started_at, coalesced):
+        first_token_at = None
+        pieces = []
+        completed = False
+
+        try:
+            for piece in flight.subscribe():
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                pieces.append(piece)
+                yield piece
+            # an answer cut by the deadline is not complete, even if the flight ended normally
+            completed = not flight.expired
+        finally:
+            self.inflight.leave(key, flight)
+            # ttft from the shared completion request, end_to_end_ttft from this consumer's question
+            self.store_reply(pieces, flight.started_at or query_started_at, first_token_at, None, completed,
+                             query_started_at)
+            self.last_stream_stats["coalesced"] = coalesced
+
+    async def aquery(self, query, difficulty):
+        """
+        Async version of query: the embedding runs in a worker thread, the search
+        uses the async Qdrant client and the answer is streamed from AsyncOpenAI.
+        Returns an async generator of text deltas.
+        """
+
+        query_started_at = time.perf_counter()
+
+        if self.speculative:
+            context, _ = await asyncio.gather(self.agenerate_context(query), self.awarm_up())
+        else:
+            context = await self.agenerate_context(query)
+        messages = self.build_messages(query, context, difficulty=difficulty)
+        self.history.add("user", query)
+
+        started_at = time.perf_counter()
+        try:
+            response = await self.llm_client.acreate_stream(
+                model=self.llm_name,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        except LLMUnavailableError as e:
+            print(f"LLM unavailable, answering with the retrieved context only: {e}")
+            return self.adegraded_answer(context)
+
+        return self.astream_and_store(response, started_at=started_at, query_started_at=query_started_at)
+
+    async def adegraded_answer(self, context):
+        yield self.degraded_answer(context)
@@ -0,0 +1,70 @@
+import time
+from sentence_transformers import CrossEncoder
+
+
+def batch_iterate(lst, batch_size):
+    for i in range(0, len(lst), batch_size):
+        yield lst[i : i + batch_size]
+
+
+class Reranker:
+    def __init__(self, model_name="cross-encoder/mmarco-mMiniLMv2-L12-H384-v1", top_n=3,
+                 threshold=0.2, oversampling=2, latency_budget=1.0, batch_size=8):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.threshold = threshold
+        self.oversampling = oversampling
+        self.latency_budget = latency_budget
+        self.batch_size = batch_size
+        self.model = self._load_model()
+
+    def _load_model(self):
+        # Small multilingual cross-encoder, runs on CPU next to the embedding model.
+        # Only read from ./hf_cache: a query must never wait for (or fail on) a download
+        try:
+            return CrossEncoder(self.model_name,
+                                max_length=512,
+                                device="cpu",
+                                cache_folder='./hf_cache',
+                                local_files_only=True)
+        except OSError as e:
+            raise RuntimeError(
+                f"Reranker model {self.model_name} not found in ./hf_cache, fetch it once with "
+                f"`huggingface-cli download {self.model_name} --cache-dir ./hf_cache` "
+                f"or set RERANKER_ENABLED=false"
+            ) from e
+
+    def rerank(self, query, points):
+        """
+        Rescores the candidate points against the query and keeps the top_n
+        above the threshold. If the latency budget is exceeded the candidates
+        are returned in their original (vector) order.
+        """
+        if not points:
+            return points
+
+        start_time = time.time()
+        scores = []
+        for batch in batch_iterate(points, self.batch_size):
+            pairs = [(query, point.payload["context"]) for point in batch]
+            scores.extend(self.model.predict(pairs, batch_size=self.batch_size))
+
+            if time.time() - start_time > self.latency_budget:
+                print(f"Reranking exceeded the latency budget ({self.latency_budget:.2f}s), "
+                      f"falling back to vector order")
+                return points[:self.top_n]
+
+        ranked = sorted(zip(scores, points), key=lambda x: x[0], reverse=True)
+
+        selected = []
+        for score, point in ranked[:self.top_n]:
+            if self.threshold is not None and score < self.threshold:
+                break
+            point.score = float(score)
+            selected.append(point)
+
+        end_time = time.time()
+        print(f"Execution time for reranking: {end_time - start_time:.4f} seconds "
+              f"({len(selected)}/{len(points)} chunks kept)")
+
+        return selected
@@ -1,31 +1,74 @@
 # retrieval.py
 
 import time
+import asyncio
 from qdrant_client import models
 
 class Retriever:
-    def __init__(self, vector_db, embeddata):
+    def __init__(self, vector_db, embeddata, reranker=None):
         self.vector_db = vector_db
         self.embeddata = embeddata
+        self.reranker = reranker
 
-    def search(self, query, top_k=7):
+    def search(self, query, top_k=7, doc_ids=None, filters=None):
         query_embedding = self.embeddata.embed_model.get_query_embedding(query)
 
+        # Oversample the candidate set when a reranker will cut it down afterwards
+        limit = top_k * self.reranker.oversampling if self.reranker else top_k
+
         start_time = time.time()
         result = self.vector_db.client.search(
             collection_name=self.vector_db.collection_name,
             query_vector=query_embedding,
-            limit=top_k,
-            search_params=models.SearchParams(
-                quantization=models.QuantizationSearchParams(
-                    ignore=True,
-                    rescore=True,   # re-ranking with vector similarity
-                    oversampling=2.0,
-                )
-            ),
+            limit=limit,
+            query_filter=self._query_filter(doc_ids, filters),
+            search_params=self._search_params(),
+            with_payload=self.vector_db.payload_selector(),
             timeout=1000,
         )
         end_time = time.time()
         print(f"Execution time for the search: {end_time - start_time:.4f} seconds")
 
-        return result
+        if self.reranker:
+            # the cross-encoder needs the text of every candidate
+            result = self.reranker.rerank(query, self.vector_db.hydrate(result))
+
+        return self.vector_db.hydrate(result)
+
+    async def asearch(self, query, top_k=7, doc_ids=None, filters=None):
+        # the embedding model is CPU bound: run it in a worker thread to keep the loop free
+        query_embedding = await asyncio.to_thread(self.embeddata.embed_model.get_query_embedding, query)
+
+        limit = top_k * self.reranker.oversampling if self.reranker else top_k
+
+        start_time = time.time()
+        result = await self.vector_db.async_client.search(
+            collection_name=self.vector_db.collection_name,
+            query_vector=query_embedding,
+            limit=limit,
+            query_filter=self._query_filter(doc_ids, filters),
+            search_params=self._search_params(),
+            with_payload=self.vector_db.payload_selector(),
+            timeout=1000,
+        )
+        end_time = time.time()
+        print(f"Execution time for the async search: {end_time - start_time:.4f} seconds")
+
+        if self.reranker:
+            result = await self.vector_db.ahydrate(result)
+            result = await asyncio.to_thread(self.reranker.rerank, query, result)
+
+        return await self.vector_db.ahydrate(result)
+
+    def _query_filter(self, doc_ids, filters=None):
+        # restrict the search to a set of documents and metadata, evaluated inside Qdrant
+        return self.vector_db.build_filter(doc_ids, filters)
+
+    def _search_params(self):
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                ignore=True,
+                rescore=True,   # re-ranking with vector similarity
+                oversampling=2.0,
+            )
+        )
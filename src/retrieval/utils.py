@@ -3,20 +3,22 @@ from docling.datamodel.base_models import InputFormat
 from docling.pipeline.vlm_pipeline import VlmPipeline
 from docling.datamodel import vlm_model_specs
 from docling.datamodel.pipeline_options import PdfPipelineOptions, VlmPipelineOptions, AcceleratorDevice, AcceleratorOptions
-import re
+from docling_core.types.doc import ImageRefMode
+import threading
 from collections import OrderedDict
 
 
-#Replace each base64 image with its corresponding summary
-def replace_base64_images(md_text):
-    pattern = r'!\[.*?\]\(data:image\/png;base64,[A-Za-z0-9+/=\n]+\)'
+# marks where a picture was in the exported markdown, see image_summary.splice_summaries
+IMAGE_PLACEHOLDER = "<!-- image -->"
 
-    return re.sub(pattern, "", md_text)
+# pipeline options (json) -> DocumentConverter, with its models already loaded after the first use
+_converters = {}
+_converters_lock = threading.Lock()
 
 
-def convert_pdf_to_markdown(pdf_path: str) -> str:  
+def default_pipeline_options():
     # Configura pipeline PDF (OCR + estrazione immagini)
-    pipeline_options = PdfPipelineOptions(
+    return PdfPipelineOptions(
         do_ocr=True,
         do_table_structure=True,
         generate_picture_images=True,
@@ -27,23 +29,65 @@ def convert_pdf_to_markdown(pdf_path: str) -> str:
         accelerator_options=AcceleratorOptions(),
     )
 
-    converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: 
-                PdfFormatOption(
-                    pipeline_options=pipeline_options,
-                )
-        }
-    )
+
+def adaptive_pipeline_options(do_ocr=True, keep_images=False):
+    """
+    Default options tuned per page range: OCR only where there is no text layer,
+    and no page/picture rendering when the images are stripped from the markdown.
+    Table structure and formula models crop the page themselves, so the text is unchanged.
+    """
+    pipeline_options = default_pipeline_options()
+    pipeline_options.do_ocr = do_ocr
+    if not keep_images:
+        pipeline_options.generate_picture_images = False
+        pipeline_options.generate_page_images = False
+        pipeline_options.images_scale = 1.0
+    return pipeline_options
+
+
+def get_converter(pipeline_options=None):
+    """
+    One DocumentConverter per set of pipeline options and process: layout, table,
+    OCR and formula models are loaded once instead of at every conversion.
+    """
+    pipeline_options = pipeline_options or default_pipeline_options()
+    key = pipeline_options.model_dump_json()
+    with _converters_lock:
+        if key not in _converters:
+            _converters[key] = DocumentConverter(
+                format_options={
+                    InputFormat.PDF: 
+                        PdfFormatOption(
+                            pipeline_options=pipeline_options,
+                        )
+                }
+            )
+        return _converters[key]
+
+
+def prewarm_converter(pipeline_options=None):
+    # loads the models now, so that the first upload does not pay for it
+    get_converter(pipeline_options).initialize_pipeline(InputFormat.PDF)
+
+
+def convert_pdf(pdf_path: str, pipeline_options=None):
+    converter = get_converter(pipeline_options)
 
     # Converte PDF in Docling Document
     result = converter.convert(pdf_path)
-    document = result.document
-   
-    markdown_text = document.export_to_markdown(image_mode="embedded")
-
-    
+    return result.document
 
-    return replace_base64_images(markdown_text)
 
+def export_pages(document, image_placeholder=IMAGE_PLACEHOLDER):
+    """
+    Markdown of every page, in page order: [(page_no, markdown), ...].
+    Keeps the page provenance that a single markdown export loses.
+    Images are written as image_placeholder, never as base64 text.
+    """
+    pages = []
+    for page_no in sorted(document.pages):
+        markdown_text = document.export_to_markdown(image_mode=ImageRefMode.PLACEHOLDER,
+                                                    image_placeholder=image_placeholder, page_no=page_no)
+        pages.append((page_no, markdown_text))
+    return pages
 
@@ -0,0 +1,22 @@
+import re
+
+import pytest
+
+
+class WhitespaceTokenizer:
+    """Word-level stand-in for the Hugging Face tokenizer: same call signature, offsets included."""
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False):
+        spans = [match.span() for match in re.finditer(r"\S+", text)]
+        encoding = {"input_ids": [text[start:end] for start, end in spans]}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = spans
+        return encoding
+
+    def decode(self, ids):
+        # like the BertNormalizer: lowercased, no newlines
+        return " ".join(ids).lower()
+
+
+@pytest.fixture
+def tokenizer():
+    return WhitespaceTokenizer()
@@ -0,0 +1,54 @@
+import pytest
+
+chunk_embed = pytest.importorskip("src.retrieval.chunk_embed")
+
+from src.retrieval.chunk_embed import chunk_pages, encode_page, encode_pages
+
+
+def test_headings_are_mapped_to_their_token_offset(tokenizer):
+    ids, headings = encode_page("Introduzione breve\n# Primi piatti\nRisotto giallo\n## Risotto alla milanese", tokenizer)
+
+    assert ids[:2] == ["Introduzione", "breve"]
+    assert headings == [(2, "Primi piatti"), (7, "Risotto alla milanese")]
+    assert ids[2] == "#" and ids[7] == "##"
+
+
+def test_headings_keep_their_case_although_chunks_are_lowercased(tokenizer):
+    chunks, metadata = chunk_pages([(1, "# Primi Piatti\nRisotto alla milanese")], tokenizer=tokenizer)
+
+    assert chunks == ["# primi piatti risotto alla milanese"]
+    assert metadata[0]["headings"] == ["Primi Piatti"]
+    assert metadata[0]["course"] == ["primi"]
+
+
+def test_chunk_starting_mid_section_carries_the_section(tokenizer):
+    body = " ".join(f"parola{i}" for i in range(20))
+    pages = [(1, f"# Dolci\n{body}\n# Secondi\nArrosto di vitello")]
+
+    _, metadata = chunk_pages(pages, tokenizer=tokenizer, token_limit=10, stride=2)
+
+    # only the first chunk holds the "Dolci" heading, the second one starts inside its section
+    assert [m["headings"] for m in metadata] == [["Dolci"], ["Dolci"], ["Dolci", "Secondi"], ["Secondi"]]
+
+
+def test_chunks_spanning_pages_keep_their_page_range(tokenizer):
+    pages = [(1, "uno due tre quattro"), (2, "cinque sei sette otto"), (3, "nove dieci")]
+
+    _, metadata = chunk_pages(pages, tokenizer=tokenizer, token_limit=6, stride=1)
+
+    assert [(m["page_start"], m["page_end"]) for m in metadata] == [(1, 2), (2, 3)]
+
+    _, per_page = chunk_pages(pages, tokenizer=tokenizer, token_limit=6, stride=1, per_page=True)
+    assert [(m["page_start"], m["page_end"]) for m in per_page] == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_encoded_pages_are_not_tokenized_again(tokenizer):
+    pages = [(1, "# Antipasti\nBruschette al pomodoro")]
+    encoded = encode_pages(pages, tokenizer)
+
+    class NoEncode(type(tokenizer)):
+        def __call__(self, *args, **kwargs):
+            raise AssertionError("page tokenized twice")
+
+    _, metadata = chunk_pages(pages, tokenizer=NoEncode(), encoded=encoded)
+    assert metadata[0]["headings"] == ["Antipasti"]
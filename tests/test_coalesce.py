@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from src.retrieval.coalesce import Flight, SingleFlight
+
+
+def test_first_caller_leads_the_others_join():
+    inflight = SingleFlight()
+    flight, leader = inflight.join("q")
+    same, follower_leads = inflight.join("q")
+    other, other_leads = inflight.join("other q")
+
+    assert leader and not follower_leads and other_leads
+    assert same is flight and other is not flight
+    assert flight.subscribers == 2
+
+
+def test_late_subscriber_replays_from_the_start():
+    flight = Flight()
+    flight.publish("Risotto ")
+    flight.publish("alla milanese")
+    flight.finish()
+
+    assert list(flight.subscribe()) == ["Risotto ", "alla milanese"]
+    assert list(flight.subscribe()) == ["Risotto ", "alla milanese"]
+
+
+def test_subscribers_receive_pieces_while_produced():
+    flight = Flight()
+    received = []
+    consumers = [threading.Thread(target=lambda: received.append(list(flight.subscribe()))) for _ in range(3)]
+    for consumer in consumers:
+        consumer.start()
+
+    for piece in ["a", "b", "c"]:
+        flight.publish(piece)
+    flight.finish()
+    for consumer in consumers:
+        consumer.join(timeout=5)
+
+    assert received == [["a", "b", "c"]] * 3
+
+
+def test_producer_error_reaches_every_subscriber():
+    flight = Flight()
+    flight.publish("a")
+    flight.finish(error=RuntimeError("upstream failed"))
+
+    pieces = []
+    with pytest.raises(RuntimeError, match="upstream failed"):
+        for piece in flight.subscribe():
+            pieces.append(piece)
+    assert pieces == ["a"]
+
+
+def test_last_subscriber_leaving_cancels_the_flight():
+    inflight = SingleFlight()
+    flight, _ = inflight.join("q")
+    inflight.join("q")
+
+    inflight.leave("q", flight)
+    assert not flight.cancelled
+    inflight.leave("q", flight)
+    assert flight.cancelled
+
+    # the next asker starts a new flight
+    new_flight, leader = inflight.join("q")
+    assert leader and new_flight is not flight
+
+
+def test_finished_flight_is_forgotten_but_still_readable():
+    inflight = SingleFlight()
+    flight, _ = inflight.join("q")
+    flight.publish("a")
+    inflight.forget("q", flight)
+    flight.finish()
+
+    new_flight, leader = inflight.join("q")
+    assert leader and new_flight is not flight
+    assert list(flight.subscribe()) == ["a"]
+
+    # forgetting an old flight does not drop the new one
+    inflight.forget("q", flight)
+    assert inflight.join("q") == (new_flight, False)
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("tiktoken")
+
+from src.retrieval.context import ApproximateEncoding, ContextBuilder, split_sentences
+
+
+@pytest.fixture
+def make_builder(monkeypatch):
+    # deterministic counts, and no BPE download
+    monkeypatch.setattr(ContextBuilder, "_load_encoding", lambda self, model_name: ApproximateEncoding())
+    return lambda **kwargs: ContextBuilder(**kwargs)
+
+
+def point(text, score):
+    return SimpleNamespace(payload={"context": text}, score=score)
+
+
+def test_split_sentences_keeps_every_character():
+    text = "Tritare la cipolla. Tostare il riso!\n- burro 80 g\nServire caldo"
+    sentences = split_sentences(text)
+    assert "".join(sentences) == text
+    assert sentences[:2] == ["Tritare la cipolla. ", "Tostare il riso!\n"]
+
+
+def test_chunks_are_packed_by_score(make_builder):
+    builder = make_builder(token_budget=1000)
+    low = point("Contorno: insalata di finocchi e arance.", 0.1)
+    high = point("Primo: risotto alla milanese con zafferano.", 0.9)
+
+    context, stats = builder.build([low, high])
+
+    assert context.split(builder.separator) == [high.payload["context"], low.payload["context"]]
+    assert stats["chunks_used"] == 2
+    assert stats["candidate_chunks"] == 2
+
+
+def test_overlapping_sentences_are_dropped(make_builder):
+    builder = make_builder(token_budget=1000)
+    first = point("Ingredienti:\nTostare il riso a fuoco vivo per due minuti. Bagnare con il brodo caldo.", 0.9)
+    second = point("Ingredienti:\nBagnare con il brodo caldo. Mantecare con burro e parmigiano.", 0.5)
+
+    context, stats = builder.build([first, second])
+
+    assert context.count("Bagnare con il brodo caldo.") == 1
+    assert "Mantecare con burro e parmigiano." in context
+    # short lines legitimately repeat across recipes
+    assert context.count("Ingredienti:") == 2
+    assert stats["sentences_deduplicated"] == 1
+
+
+def test_last_chunk_is_truncated_at_a_sentence_boundary(make_builder):
+    builder = make_builder(token_budget=40)
+    first = point("Il risotto alla milanese si prepara con riso Carnaroli.", 0.9)
+    second = point("Sciogliere lo zafferano nel brodo. Aggiungerlo a metà cottura. "
+                   "Mantecare fuori dal fuoco con burro freddo e Grana Padano grattugiato.", 0.8)
+    third = point("Servire subito.", 0.7)
+
+    context, stats = builder.build([first, second, third])
+
+    assert stats["context_tokens"] <= builder.token_budget
+    assert stats["chunks_truncated"] == 1
+    assert context.endswith("Aggiungerlo a metà cottura.")
+    assert "Servire subito." not in context
+    # tokens of every candidate are still reported
+    assert stats["candidate_tokens"] == sum(builder.count_tokens(p.payload["context"]) for p in (first, second, third))
+
+
+def test_approximate_encoding_round_trips():
+    encoding = ApproximateEncoding()
+    tokens = encoding.encode("risotto alla milanese")
+    assert len(tokens) == 6
+    assert encoding.decode(tokens[:2]) == "risotto "
+
+
+def test_missing_model_name_uses_the_default_encoding(monkeypatch):
+    import tiktoken
+
+    loaded = []
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda name: pytest.fail("looked up a missing model"))
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: loaded.append(name) or name)
+
+    assert ContextBuilder(model_name=None).encoding == "o200k_base"
+    assert loaded == ["o200k_base"]
@@ -0,0 +1,76 @@
+from src.retrieval.history import ConversationHistory, TRUNCATION_MARKER
+
+
+def count_tokens(text):
+    # about 4 characters per token
+    return (len(text) + 3) // 4
+
+
+class Encoding:
+    def encode(self, text, disallowed_special=()):
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def test_oldest_turns_are_dropped_to_fit_the_budget():
+    history = ConversationHistory(count_tokens, max_tokens=30)
+    for i in range(6):
+        history.add("user", f"domanda numero {i} sul risotto")
+        history.add("assistant", f"risposta numero {i} sul risotto")
+
+    assert history.total_tokens() <= 30
+    assert history.messages()[-1]["content"] == "risposta numero 5 sul risotto"
+    assert history.messages()[0]["role"] == "user"
+
+
+def test_window_never_starts_with_an_assistant_reply():
+    history = ConversationHistory(count_tokens, max_tokens=20)
+    history.add("user", "u" * 40)
+    history.add("assistant", "a" * 40)
+    history.add("user", "u" * 40)
+
+    assert [message["role"] for message in history.messages()] == ["user"]
+
+
+def test_dropped_turns_are_summarized():
+    calls = []
+
+    def summarizer(summary, dropped):
+        calls.append((summary, dropped))
+        return f"riassunto {len(calls)}"
+
+    history = ConversationHistory(count_tokens, max_tokens=12, summarizer=summarizer)
+    history.add("user", "vorrei un primo piatto")
+    history.add("assistant", "risotto alla milanese")
+    history.add("user", "e un dolce?")
+
+    assert calls[0] == (None, [{"role": "user", "content": "vorrei un primo piatto"},
+                               {"role": "assistant", "content": "risotto alla milanese"}])
+    messages = history.messages()
+    assert messages[0] == {"role": "system", "content": "Riassunto della conversazione precedente: riassunto 1"}
+    assert messages[1:] == [{"role": "user", "content": "e un dolce?"}]
+
+    history.clear()
+    assert history.messages() == [] and history.total_tokens() == 0
+
+
+def test_long_message_is_truncated_within_the_cap():
+    history = ConversationHistory(count_tokens, max_tokens=1000, max_message_tokens=10)
+    history.add("user", "parola " * 50)
+
+    turn = history.turns[0]
+    assert turn["content"].endswith(TRUNCATION_MARKER)
+    assert turn["content"].startswith("parola parola")
+    assert turn["tokens"] <= 10
+
+
+def test_text_without_spaces_is_truncated_by_tokens():
+    for encoding in (Encoding(), None):
+        history = ConversationHistory(count_tokens, max_tokens=1000, max_message_tokens=10, encoding=encoding)
+        history.add("user", "x" * 200)
+
+        turn = history.turns[0]
+        assert turn["content"] == "x" * 32 + TRUNCATION_MARKER
+        assert turn["tokens"] <= 10
@@ -0,0 +1,53 @@
+import pytest
+
+image_summary = pytest.importorskip("src.retrieval.image_summary")
+
+from src.retrieval.utils import IMAGE_PLACEHOLDER
+from src.retrieval.image_summary import ImageSummarizer, StubCaptioner, splice_summaries
+
+
+class CountingCaptioner(StubCaptioner):
+    def __init__(self):
+        self.batches = []
+
+    def describe(self, images):
+        self.batches.append(len(images))
+        return super().describe(images)
+
+
+def test_summaries_replace_placeholders_in_reading_order():
+    pages = [
+        (1, f"# Antipasti\n{IMAGE_PLACEHOLDER}\nBruschette\n{IMAGE_PLACEHOLDER}"),
+        (2, "Solo testo"),
+        (3, f"{IMAGE_PLACEHOLDER} Tiramisù"),
+    ]
+    images = [(1, "a.png"), (1, "b.png"), (3, "c.png")]
+
+    spliced = splice_summaries(pages, images, ["pane", "pomodori", "dolce"])
+
+    assert spliced == [
+        (1, "# Antipasti\n[Immagine: pane]\nBruschette\n[Immagine: pomodori]"),
+        (2, "Solo testo"),
+        (3, "[Immagine: dolce] Tiramisù"),
+    ]
+
+
+def test_placeholders_without_picture_are_dropped():
+    pages = [(1, f"prima {IMAGE_PLACEHOLDER} mezzo {IMAGE_PLACEHOLDER} fine")]
+
+    assert splice_summaries(pages, [(1, "a.png")], ["logo"]) == [(1, "prima [Immagine: logo] mezzo  fine")]
+    assert splice_summaries(pages, [], []) == [(1, "prima  mezzo  fine")]
+
+
+def test_images_are_described_once_and_cached(tmp_path):
+    backend = CountingCaptioner()
+    summarizer = ImageSummarizer(backend, db_path=str(tmp_path / "summaries.db"), batch_size=2)
+    logo, photo, chart = b"logo", b"photo", b"chart"
+
+    first = summarizer.summarize([logo, photo, logo, chart])
+    second = summarizer.summarize([chart, logo])
+
+    assert first[0] == first[2]
+    assert second == [first[3], first[0]]
+    # three distinct images, in batches of two; nothing left to describe the second time
+    assert backend.batches == [2, 1]
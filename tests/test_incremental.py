@@ -0,0 +1,67 @@
+import pytest
+
+incremental = pytest.importorskip("src.retrieval.incremental")
+
+from src.retrieval.chunk_embed import chunk_pages
+from src.retrieval.incremental import PageManifest, chunk_id, page_runs, page_sections
+
+
+def test_consecutive_pages_form_one_run():
+    assert page_runs([1, 2, 3, 7, 8, 10]) == [(1, 3), (7, 8), (10, 10)]
+
+
+def test_runs_are_split_at_max_pages():
+    assert page_runs(range(1, 21), max_pages=8) == [(1, 8), (9, 16), (17, 20)]
+
+
+def test_unsorted_pages_and_generators():
+    assert page_runs(p for p in [5, 3, 4, 1]) == [(1, 1), (3, 5)]
+    assert page_runs([]) == []
+
+
+def test_chunk_ids_are_stable():
+    assert chunk_id("ricettario", 3, 0) == chunk_id("ricettario", 3, 0)
+    assert len({chunk_id("ricettario", 3, 0), chunk_id("ricettario", 3, 1), chunk_id("ricettario", 4, 0),
+                chunk_id("altro", 3, 0)}) == 4
+
+
+def test_manifest_update_and_clear(tmp_path):
+    manifest = PageManifest(str(tmp_path / "jobs.db"))
+    manifest.update("ricettario", {1: ("aaa", 2, "Primi"), 2: ("bbb", 1, "Primi"), 3: ("ccc", 4, "Dolci")})
+    manifest.update("ricettario", {2: ("bbb2", 3, "Secondi")}, removed=[3])
+
+    assert manifest.get("ricettario") == {1: ("aaa", 2, "Primi"), 2: ("bbb2", 3, "Secondi")}
+
+    manifest.clear("ricettario")
+    assert manifest.get("ricettario") == {}
+
+
+def test_page_sections_come_from_the_previous_page():
+    pages = [(5, "# Secondi\nArrosto di vitello"), (6, "Polpette al sugo"), (50, "Biscotti al burro")]
+    previous = {4: "Primi", 5: "Primi", 49: "Dolci"}
+
+    starts, ends = page_sections(pages, previous)
+
+    assert starts == {5: "Primi", 6: "Secondi", 50: "Dolci"}
+    assert ends[5] == "Secondi" and ends[6] == "Secondi" and ends[50] == "Dolci"
+
+
+def test_far_apart_changed_pages_keep_their_own_section(tokenizer):
+    # pages 5 and 50 changed: page 50 is in "Dolci", not in the last heading of page 5
+    pages = [(5, "# Secondi piatti\nArrosto di vitello con patate"), (50, "Crostata di mele e biscotti")]
+    starts, _ = page_sections(pages, {4: "Primi piatti", 49: "Dolci"})
+
+    _, metadata = chunk_pages(pages, tokenizer=tokenizer, per_page=True, sections=starts)
+
+    assert [m["page_start"] for m in metadata] == [5, 50]
+    assert metadata[0]["headings"] == ["Primi piatti", "Secondi piatti"]
+    assert metadata[1]["headings"] == ["Dolci"]
+    assert metadata[1]["course"] == ["dolci"]
+
+
+def test_per_page_without_sections_does_not_carry_across_gaps(tokenizer):
+    pages = [(5, "# Secondi piatti\nArrosto"), (6, "Polpette"), (50, "Crostata")]
+
+    _, metadata = chunk_pages(pages, tokenizer=tokenizer, per_page=True)
+
+    assert [m["headings"] for m in metadata] == [["Secondi piatti"], ["Secondi piatti"], []]
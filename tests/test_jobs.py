@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+
+jobs = pytest.importorskip("src.retrieval.jobs")
+
+from src.retrieval.jobs import JobQueue, connect, document_id, is_stale
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.db"), upload_dir=str(tmp_path / "uploads"), resume=False)
+    yield queue
+    queue.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def add_job(queue, job_id, name, status, updated_at, owner_pid=None):
+    with connect(queue.db_path) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, content_hash, name, pdf_path, status, stage, owner_pid, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, f"hash-{job_id}", name, f"{job_id}.pdf", status, status, owner_pid, updated_at, updated_at),
+        )
+    return queue.get(job_id)
+
+
+def test_document_id_follows_the_ingest_mode(monkeypatch):
+    monkeypatch.delenv("INCREMENTAL_INGEST", raising=False)
+    assert document_id("ricettario", "ab" * 32) == "ab" * 8
+    monkeypatch.setenv("INCREMENTAL_INGEST", "true")
+    assert document_id("ricettario", "ab" * 32) == "ricettario"
+
+
+def test_older_version_uploaded_again_is_superseded(queue, monkeypatch):
+    now = time.time()
+    v1 = add_job(queue, "v1", "ricettario", "done", now - 20)
+    v2 = add_job(queue, "v2", "ricettario", "done", now - 10)
+    add_job(queue, "v3", "ricettario", "failed", now)
+
+    monkeypatch.setenv("INCREMENTAL_INGEST", "true")
+    assert queue._superseded(v1)
+    assert not queue._superseded(v2)
+
+    # full mode: every version has its own doc_id, nothing to run again
+    monkeypatch.setenv("INCREMENTAL_INGEST", "false")
+    assert not queue._superseded(v1)
+
+
+def test_only_jobs_of_dead_processes_are_stale(queue):
+    now = time.time()
+    assert not is_stale(add_job(queue, "mine", "a", "running", now, owner_pid=os.getpid()))
+    assert is_stale(add_job(queue, "orphan", "b", "queued", now, owner_pid=None))
+    assert not is_stale(add_job(queue, "finished", "c", "done", now, owner_pid=None))
@@ -0,0 +1,198 @@
+import time
+import socket
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+openai = pytest.importorskip("openai")
+uvicorn = pytest.importorskip("uvicorn")
+pytest.importorskip("fastapi")
+
+from benchmarks import fake_llm_server
+from src.retrieval.llm_client import CircuitBreaker, CircuitOpenError, LLMUnavailableError, ResilientLLM
+
+
+MESSAGES = [{"role": "user", "content": "Come si fa il risotto alla milanese?"}]
+
+
+class Rolls:
+    """Replaces the fake server's rng: the given rolls first, then requests that go through."""
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def random(self):
+        return self.values.pop(0) if self.values else 0.99
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_llm_server.app, host="127.0.0.1", port=port,
+                                           log_level="warning", timeout_graceful_shutdown=1))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    # fast, short answers; each test sets its own error and stall rolls
+    monkeypatch.setattr(fake_llm_server, "TTFT", 0.01)
+    monkeypatch.setattr(fake_llm_server, "TOKENS_PER_SECOND", 1000)
+    monkeypatch.setattr(fake_llm_server, "COMPLETION_TOKENS", 20)
+    monkeypatch.setattr(fake_llm_server, "ERROR_RATE", 0.0)
+    monkeypatch.setattr(fake_llm_server, "STALL_RATE", 0.0)
+    monkeypatch.setattr(fake_llm_server, "rng", Rolls())
+    return monkeypatch
+
+
+def make_llm(base_url, **kwargs):
+    client = openai.OpenAI(base_url=base_url, api_key="fake", max_retries=0)
+    kwargs = {"timeout": 5.0, "deadline": 10.0, "backoff_base": 0.01, **kwargs}
+    return ResilientLLM(client, **kwargs)
+
+
+def read_answer(stream):
+    return "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+
+
+# --------- CircuitBreaker ---------
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+# --------- ResilientLLM ---------
+def test_retries_server_errors(base_url, fake_llm):
+    fake_llm.setattr(fake_llm_server, "ERROR_RATE", 0.5)
+    fake_llm.setattr(fake_llm_server, "rng", Rolls(0.1, 0.1))
+    llm = make_llm(base_url, max_retries=3)
+
+    answer = read_answer(llm.create_stream(model="fake-llm", messages=MESSAGES, stream=True))
+
+    assert answer.startswith("**Risotto alla milanese**")
+    assert llm.metrics["error"] == 2
+    assert llm.metrics["retry"] == 2
+    assert llm.metrics["success"] == 1
+
+
+def test_gives_up_then_breaker_fails_fast(base_url, fake_llm):
+    fake_llm.setattr(fake_llm_server, "ERROR_RATE", 1.0)
+    llm = make_llm(base_url, max_retries=1, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+
+    with pytest.raises(LLMUnavailableError):
+        llm.create_stream(model="fake-llm", messages=MESSAGES, stream=True)
+    assert llm.metrics["error"] == 2
+
+    with pytest.raises(CircuitOpenError):
+        llm.create_stream(model="fake-llm", messages=MESSAGES, stream=True)
+    assert llm.metrics["circuit_open"] == 1
+
+
+def test_non_streaming_create_retries(base_url, fake_llm):
+    fake_llm.setattr(fake_llm_server, "ERROR_RATE", 0.5)
+    fake_llm.setattr(fake_llm_server, "rng", Rolls(0.1))
+    llm = make_llm(base_url, max_retries=1)
+
+    response = llm.create(model="fake-llm", messages=MESSAGES)
+
+    assert response.choices[0].message.content
+    assert llm.metrics["retry"] == 1
+
+
+def test_hedge_wins_over_stalled_request(base_url, fake_llm):
+    # the first request never answers, the hedge launched after the observed latency does
+    fake_llm.setattr(fake_llm_server, "STALL_RATE", 0.5)
+    fake_llm.setattr(fake_llm_server, "rng", Rolls(0.1))
+    llm = make_llm(base_url, timeout=3.0, hedge=True, hedge_min_samples=1)
+    llm.latencies.append(0.3)
+
+    started_at = time.monotonic()
+    answer = read_answer(llm.create_stream(model="fake-llm", messages=MESSAGES, stream=True))
+
+    assert answer
+    assert time.monotonic() - started_at < 2.0
+    assert llm.metrics["hedge_launched"] == 1
+    assert llm.metrics["hedge_won"] == 1
+
+
+
+class SlowStream:
+    def __init__(self, delay):
+        self.delay = delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(self.delay)
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+def test_cancelled_hedge_loser_closes_its_stream():
+    # the primary's response is open but its first chunk never comes: the hedge wins
+    streams = [SlowStream(10.0), SlowStream(0.0)]
+    opened = list(streams)
+
+    async def create(**kwargs):
+        return streams.pop(0)
+
+    async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    llm = ResilientLLM(None, async_client=async_client, hedge=True, hedge_min_samples=1)
+    llm.latencies.append(0.05)
+
+    async def main():
+        stream = await llm.acreate_stream(model="fake-llm", messages=MESSAGES, stream=True)
+        await asyncio.sleep(0.01)
+        return stream
+
+    stream = asyncio.run(main())
+
+    assert stream.stream is opened[1] and not opened[1].closed
+    assert opened[0].closed
+    assert llm.metrics["hedge_won"] == 1
+
+def test_deadline_cuts_a_long_stream(base_url, fake_llm):
+    fake_llm.setattr(fake_llm_server, "TOKENS_PER_SECOND", 20)
+    fake_llm.setattr(fake_llm_server, "COMPLETION_TOKENS", 100)
+    llm = make_llm(base_url, timeout=0.5, deadline=0.5)
+
+    stream = llm.create_stream(model="fake-llm", messages=MESSAGES, stream=True)
+    chunks = 0
+    for _ in stream:
+        if llm.stream_expired(stream):
+            break
+        chunks += 1
+    stream.close()
+
+    assert 0 < chunks < 100
+    assert llm.metrics["stream_deadline_exceeded"] == 1
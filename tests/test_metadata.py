@@ -0,0 +1,60 @@
+import pytest
+
+from src.retrieval.metadata import detect_courses, detect_ingredients, extract_headings, heading_spans
+
+
+PAGE = "# Primi piatti\n\n## Risotto alla milanese\n\nRiso, zafferano e burro. Cipolla tritata.\n"
+
+
+def test_headings_of_the_markdown():
+    assert extract_headings(PAGE) == ["Primi piatti", "Risotto alla milanese"]
+    assert heading_spans(PAGE) == [(0, "Primi piatti"), (16, "Risotto alla milanese")]
+    # a hash inside a line is not a heading
+    assert extract_headings("Ricetta n. #3 della nonna") == []
+
+
+def test_courses_prefer_the_headings():
+    assert detect_courses("Riso e zafferano", headings=["Primi piatti"]) == ["primi"]
+    # nothing in the headings: fall back to the body
+    assert detect_courses("Un tiramisù per finire", headings=["Ricette della nonna"]) == ["dolci"]
+    assert detect_courses("Brodo vegetale") == []
+
+
+def test_ingredients_are_whole_words():
+    assert detect_ingredients("Riso, ZAFFERANO e burro. Cipolla tritata.") == ["burro", "cipolla", "riso",
+                                                                               "zafferano"]
+    assert detect_ingredients("risotto") == []
+
+
+class TestMetadataConditions:
+    @pytest.fixture(autouse=True)
+    def qdrant(self):
+        pytest.importorskip("qdrant_client")
+        index = pytest.importorskip("src.retrieval.index")
+        self.conditions = index.QdrantVDB.metadata_conditions
+        self.models = pytest.importorskip("qdrant_client.models")
+
+    def test_course_and_ingredients_match_any(self):
+        course, ingredients = self.conditions({"course": "dolci", "ingredients": ["burro", "uova"]})
+
+        assert course.key == "course" and course.match == self.models.MatchAny(any=["dolci"])
+        assert ingredients.key == "ingredients" and ingredients.match == self.models.MatchAny(any=["burro", "uova"])
+
+    def test_page_range_overlaps_the_chunk_span(self):
+        start, end = self.conditions({"page": [3, 5]})
+        assert (start.key, start.range) == ("page_start", self.models.Range(lte=5))
+        assert (end.key, end.range) == ("page_end", self.models.Range(gte=3))
+
+        start, end = self.conditions({"page": 4})
+        assert (start.range.lte, end.range.gte) == (4, 4)
+
+    def test_heading_is_full_text(self):
+        (heading,) = self.conditions({"heading": "risotto"})
+        assert heading.key == "headings" and heading.match == self.models.MatchText(text="risotto")
+
+    def test_empty_values_are_ignored(self):
+        assert self.conditions({"course": None, "ingredients": []}) == []
+
+    def test_unknown_filter_is_rejected(self):
+        with pytest.raises(ValueError, match="unsupported filter"):
+            self.conditions({"difficulty": "facile"})
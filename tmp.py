@@ -6,7 +6,7 @@ from src.retrieval.chunk_embed import chunk_markdown, EmbedData, save_embeddings
 from src.retrieval.index import QdrantVDB
 
 #TODO
-#TESTARE convert_pdf_to_markdown() CON IL PDF
+#TESTARE convert_pdf() + export_pages() CON IL PDF
 
 name = 'ricettario1'
 query = 'cosa posso cucinare con porri e pomodori confit?'